@@ -1,18 +1,18 @@
 #!/usr/bin/python3
-# pylint: disable=line-too-long
+# pylint: disable=line-too-long,import-outside-toplevel
 
 import os
 import sys
 import json
+import itertools
 import argparse
 import logging
 import getpass
 
-from mmdiary.transcriber.transcriber import Transcriber
-from mmdiary.notion.uploader import NotionUploader
-from mmdiary.video.uploader import youtube, dailymotion
-from mmdiary.video.processor import VideoProcessor
-from mmdiary.utils import log, medialib
+from mmdiary.utils import libwalk, log, medialib
+
+# tools are imported on demand by the commands which use them,
+# to not load heavy API clients and models on startup
 
 
 DESCRIPTION = """
@@ -69,6 +69,8 @@ def __init_video():
 
 
 def __init_youtube(confg_path):
+    from mmdiary.video.uploader import youtube
+
     print(
         "Obtain the YouTube API Client Secrets by following the instructions:",
         README_URL + "#obtaining-and-setting-up-the-youtube-api-client-secrets",
@@ -108,6 +110,8 @@ def __init_youtube(confg_path):
 
 
 def __init_dailymotion(confg_path):
+    from mmdiary.video.uploader import dailymotion
+
     print(
         "Generate an API key by following the instructions:",
         README_URL + "#generating-api-keys",
@@ -147,6 +151,8 @@ def __init_dailymotion(confg_path):
 
 
 def __init_notion(confg_path):
+    from mmdiary.notion.uploader import NotionUploader
+
     env = {}
     env["MMDIARY_NOTION_CACHE"] = os.path.join(confg_path, "notion_cache.pickle")
     os.environ.update(env)
@@ -188,6 +194,7 @@ def __init():
     confg_path = __ask("Enter main configuration folder", "~/.mmdiary")
     os.makedirs(os.path.expanduser(confg_path), exist_ok=True)
     env["MMDIARY_CACHE"] = os.path.join(confg_path, "json_cache.pickle")
+    env["MMDIARY_SCAN_INDEX"] = os.path.join(confg_path, "scan_index.pickle")
 
     if __ask_bool("Will you process audio library", True):
         __update_env(env, __init_audio())
@@ -209,43 +216,56 @@ def __init():
 
 
 def __run_transcriber(inpath):
+    from mmdiary.transcriber.transcriber import create_transcriber, skip_reused
+
     lib = medialib.MediaLib(inpath)
-    fileslist = lib.get_new()
-    if len(fileslist) == 0:
-        logging.info("Nothing to transcribe in folder %s", inpath)
+    fileslist = skip_reused(lib.iter_new(), lib)
+    first = next(fileslist, None)
+    if first is None:
+        logging.info("Nothing to transcribe in %s", inpath)
         return
+    fileslist = itertools.chain((first,), fileslist)
 
-    tr = Transcriber(
-        os.getenv("MMDIARY_TRANSCRIBE_MODEL", "medium"),
-        os.getenv("MMDIARY_TRANSCRIBE_LANGUAGE", "ru"),
-    )
+    tr = create_transcriber()
     tr.process_list(fileslist)
 
 
-def __run_video_processor():
+def __run_video_processor(masks=None):
+    from mmdiary.video.processor import VideoProcessor
+
     vp = VideoProcessor()
-    vp.process_all(None)
+    vp.process_all(masks)
 
 
-def __run_youtube_uploader():
+def __run_youtube_uploader(masks=None):
+    from mmdiary.video.uploader import youtube
+
     vup = youtube.VideoUploader()
-    res_count, err_count = vup.process_all(None)
+    res_count, err_count = vup.process_all(masks)
     logging.info("Youtube uploader done: %s, errors: %s", res_count, err_count)
 
 
-def __run_dailymotion_uploader():
+def __run_dailymotion_uploader(masks=None):
+    from mmdiary.video.uploader import dailymotion
+
     vup = dailymotion.VideoUploader()
-    res_count, err_count = vup.process_all(None)
+    res_count, err_count = vup.process_all(masks)
     logging.info("Dailymotion uploader done: %s, errors: %s", res_count, err_count)
 
 
 def __run_notion_uploader(inpath):
     lib = medialib.MediaLib(inpath)
-    fileslist = lib.get_processed(should_have_file=False)
-
-    if len(fileslist) == 0:
+    fileslist = lib.iter_processed(should_have_file=False)
+    first = next(fileslist, None)
+    if first is None:
         logging.info("Nothing to upload at Notion in folder %s", inpath)
         return
+    fileslist = itertools.chain((first,), fileslist)
+    __upload_to_notion(fileslist)
+
+
+def __upload_to_notion(fileslist):
+    from mmdiary.notion.uploader import NotionUploader
 
     nup = NotionUploader(
         token=os.getenv("MMDIARY_NOTION_TOKEN"),
@@ -258,22 +278,29 @@ def __run_notion_uploader(inpath):
     nup.process_list(fileslist)
 
 
-def __run_audio_batch(args):
-    audio_root = os.environ["MMDIARY_AUDIO_LIB_ROOT"]
-    __run_transcriber(audio_root)
-    if args.notion:
-        __run_notion_uploader(audio_root)
+def __audio_root():
+    return os.environ["MMDIARY_AUDIO_LIB_ROOT"]
 
 
-def __run_video_batch(args):
-    video_roots = list(
+def __video_roots():
+    return list(
         filter(
             None,
             os.environ["MMDIARY_VIDEO_LIB_ROOTS"].split(":"),
         ),
     )
-    for video_root in video_roots:
-        __run_transcriber(video_root)
+
+
+def __run_audio_batch(args):
+    audio_root = __audio_root()
+    __run_transcriber(audio_root)
+    if args.notion:
+        __run_notion_uploader(audio_root)
+
+
+def __run_video_batch(args):
+    video_roots = __video_roots()
+    __run_transcriber(video_roots)
 
     __run_video_processor()
 
@@ -298,6 +325,95 @@ def __run_batch(args):
         __run_video_batch(args)
 
 
+def __root_paths(roots):
+    return [os.path.abspath(os.path.expanduser(libwalk.parse_root(r)[0])) for r in roots]
+
+
+def __in_roots(filename, roots):
+    return any(os.path.commonpath((filename, root)) == root for root in roots)
+
+
+def __transcribe_files(files, watch_state):
+    """
+    Transcriber model is loaded once (kept in watch_state), on the first file to transcribe
+    Returns files recreated after transcription: json can be saved by the other process
+    (transcriber service), so the passed files don't know about it
+    """
+    from mmdiary.transcriber.transcriber import create_transcriber, skip_reused
+
+    fileslist = list(skip_reused([mf for mf in files if not mf.have_json()]))
+    if len(fileslist) == 0:
+        return files
+    if "transcriber" not in watch_state:
+        watch_state["transcriber"] = create_transcriber()
+    watch_state["transcriber"].process_list(fileslist)
+    return [medialib.MediaFile(mf.name()) for mf in files]
+
+
+def __process_changed_audio(args, files, watch_state):
+    files = __transcribe_files(files, watch_state)
+    if args.notion:
+        __upload_to_notion([mf for mf in files if mf.have_json()])
+
+
+def __process_changed_video(args, files, watch_state):
+    from mmdiary.utils import datelib
+
+    files = __transcribe_files(files, watch_state)
+    dates = set()
+    for mf in files:
+        try:
+            dates.add(mf.recorddate())
+        except (KeyError, FileNotFoundError):
+            continue
+    if len(dates) == 0:
+        return
+    masks = sorted(dates)
+    logging.info("Changed dates: %s", masks)
+
+    __run_video_processor(masks)
+    if args.youtube:
+        __run_youtube_uploader(masks)
+    if args.dailymotion:
+        __run_dailymotion_uploader(masks)
+
+    if args.notion:
+        results = datelib.DateLib().results()
+        __upload_to_notion(
+            [results[date] for date in masks if date in results and results[date].have_json()]
+        )
+
+
+def __process_changed(args, filenames, watch_state):
+    """
+    Only changed files are transcribed, and only their dates are processed and uploaded
+    """
+    filenames = [os.path.abspath(f) for f in filenames if medialib.is_media_file(f)]
+    audio = [medialib.MediaFile(f) for f in filenames if __in_roots(f, watch_state["audio"])]
+    video = [medialib.MediaFile(f) for f in filenames if __in_roots(f, watch_state["video"])]
+    if audio:
+        __process_changed_audio(args, audio, watch_state)
+    if video:
+        __process_changed_video(args, video, watch_state)
+
+
+def __run_watch(args):
+    from mmdiary.utils import watcher
+
+    # catch up with changes made while the watcher wasn't running
+    __run_batch(args)
+
+    roots = {
+        "audio": [__audio_root()] if args.audio else [],
+        "video": __video_roots() if args.video else [],
+    }
+    watch_state = {name: __root_paths(specs) for name, specs in roots.items()}
+    watcher.watch(
+        roots["audio"] + roots["video"],
+        lambda filenames: __process_changed(args, filenames, watch_state),
+    )
+
+
 def __args_parse():
     parser = argparse.ArgumentParser(
         description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
@@ -319,6 +435,12 @@ def __args_parse():
 
     parser.add_argument("--notion", help="Upload to notion", action="store_true")
 
+    parser.add_argument(
+        "--watch",
+        help="Watch libraries and process new files as they appear (runs until interrupted)",
+        action="store_true",
+    )
+
     return parser.parse_args()
 
 
@@ -331,6 +453,10 @@ def main():
         __init()
         return
 
+    if args.watch:
+        __run_watch(args)
+        return
+
     __run_batch(args)
 
 
@@ -390,8 +390,12 @@ class NotionUploader:
             raise UserWarning("Unknown json type: {tp}")
 
     def process_list(self, fileslist):
-        logging.debug("fileslist len before filter: %i", len(fileslist))
-        fileslist = list(filter(self.__filter_existing, fileslist))
+        """
+        fileslist - list or iterable (e.g. MediaLib.iter_processed)
+        """
+        if hasattr(fileslist, "__len__"):
+            logging.debug("fileslist len before filter: %i", len(fileslist))
+        fileslist = list(filter(self.__filter_existing, medialib.prefetch(fileslist)))
         logging.debug("fileslist len after filter: %i", len(fileslist))
 
         if len(fileslist) == 0:
@@ -480,7 +484,7 @@ def main():
         fileslist = (medialib.MediaFile(args.inpath),)
     elif os.path.isdir(args.inpath):
         lib = medialib.MediaLib(args.inpath)
-        fileslist = lib.get_processed(should_have_file=False)
+        fileslist = lib.iter_processed(should_have_file=False)
 
     nup.process_list(fileslist)
 
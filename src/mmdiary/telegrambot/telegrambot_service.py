@@ -42,8 +42,7 @@ class DateSelector:
     def __load(self):
         self.__files = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: [])))
         for af in g_audiofiles:
-            data = af.load_json()
-            rtime = data["recordtime"]  # "YYYY-MM-DD hh-mm-ss"
+            rtime = af.recordtime()  # "YYYY-MM-DD hh-mm-ss"
             year = rtime[:4]
             month = rtime[5:7]
             day = rtime[8:10]
@@ -111,7 +110,7 @@ class DateSelector:
 
 
 def audiofile_to_message(audiofile):
-    data = audiofile.load_json()
+    data = audiofile.load_json(readonly=True)
     texts = medialib.split_large_text(data["text"], MAX_MESSAGE_SIZE)
 
     return {
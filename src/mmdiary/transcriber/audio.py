@@ -0,0 +1,34 @@
+import subprocess
+
+import numpy as np
+
+# Whisper models input format: 16 kHz mono
+SAMPLE_RATE = 16000
+
+
+def decode_audio(filename):
+    """
+    Decodes audio track of the media file by ffmpeg to 16 kHz mono float32 samples
+    """
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads",
+        "0",
+        "-i",
+        filename,
+        "-f",
+        "s16le",
+        "-ac",
+        "1",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-",
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as ex:
+        raise UserWarning(f"Audio decoding failed: {filename}: {ex.stderr.decode()}") from ex
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
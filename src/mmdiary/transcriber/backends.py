@@ -0,0 +1,82 @@
+# pylint: disable=import-outside-toplevel,too-few-public-methods
+
+import os
+
+# faster-whisper (CTranslate2) weights precision: int8, int8_float32, float32, etc.
+COMPUTE_TYPE = os.getenv("MMDIARY_TRANSCRIBE_COMPUTE_TYPE", "int8")
+
+
+def segment(start, end, text):
+    return {"start": float(start), "end": float(end), "text": text}
+
+
+class WhisperBackend:
+    """
+    Reference openai-whisper (PyTorch) inference
+    """
+
+    NAME = "whisper"
+
+    def __init__(self, model, threads=0):
+        import torch
+        import whisper
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.__model = whisper.load_model(model)
+
+    def transcribe(self, audio, language):
+        """
+        audio - file name or 16 kHz mono float32 samples
+        Returns dict with "text", "segments" (list of start, end, text) and "language"
+        """
+        res = self.__model.transcribe(audio, language=language)
+        return {
+            "text": res.get("text", ""),
+            "segments": [segment(s["start"], s["end"], s["text"]) for s in res.get("segments", [])],
+            "language": res.get("language", language),
+        }
+
+
+class FasterWhisperBackend:
+    """
+    CPU optimized CTranslate2 inference (int8 quantization by default, see COMPUTE_TYPE),
+    the same Whisper models, requires optional faster-whisper package
+    """
+
+    NAME = "faster-whisper"
+
+    def __init__(self, model, threads=0):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as ex:
+            raise UserWarning(
+                "faster-whisper backend requires faster-whisper package: "
+                "pip install mmdiary[faster-whisper]"
+            ) from ex
+
+        self.__model = WhisperModel(
+            model, device="cpu", compute_type=COMPUTE_TYPE, cpu_threads=threads
+        )
+
+    def transcribe(self, audio, language):
+        segments, info = self.__model.transcribe(audio, language=language)
+        # segments is a generator, transcription is performed on iteration
+        segments = [segment(s.start, s.end, s.text) for s in segments]
+        return {
+            "text": "".join(s["text"] for s in segments),
+            "segments": segments,
+            "language": info.language,
+        }
+
+
+BACKENDS = {
+    WhisperBackend.NAME: WhisperBackend,
+    FasterWhisperBackend.NAME: FasterWhisperBackend,
+}
+
+
+def create_backend(name, model, threads=0):
+    if name not in BACKENDS:
+        raise UserWarning(f"Incorrect transcribe backend: {name}")
+    return BACKENDS[name](model, threads)
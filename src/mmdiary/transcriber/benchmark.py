@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import time
+
+from mmdiary.utils import log
+from mmdiary.transcriber import backends
+from mmdiary.transcriber.transcriber import media_duration
+
+DESCRIPTION = """
+Compares transcription throughput of the inference backends on sample audio/video files.
+For each backend prints model load time, transcription time (best of repeats)
+and speed: audio duration / transcription time (higher is better).
+Optional environment variables:
+    MMDIARY_TRANSCRIBE_COMPUTE_TYPE - faster-whisper weights precision (default: "int8")
+"""
+
+
+def benchmark(engine_args, files, language, repeat=1):
+    """
+    engine_args - backends.create_backend arguments: (backend, model, threads)
+    Returns dict with load, time (seconds), audio (seconds), segments, chars
+    """
+    start = time.perf_counter()
+    engine = backends.create_backend(*engine_args)
+    res = {"load": time.perf_counter() - start, "time": None}
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [engine.transcribe(filename, language) for filename in files]
+        elapsed = time.perf_counter() - start
+        if res["time"] is None or elapsed < res["time"]:
+            res["time"] = elapsed
+
+    audio = 0
+    for filename, result in zip(files, results):
+        duration = media_duration(filename)
+        if duration is None and result["segments"]:
+            duration = result["segments"][-1]["end"]
+        audio += duration or 0
+    res["audio"] = audio
+    res["segments"] = sum(len(result["segments"]) for result in results)
+    res["chars"] = sum(len(result["text"]) for result in results)
+    return res
+
+
+def __args_parse():
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("files", nargs="+", help="Sample audio/video files")
+    parser.add_argument(
+        "-b",
+        "--backends",
+        nargs="+",
+        help="Backends to compare (default: all)",
+        choices=list(backends.BACKENDS),
+        default=list(backends.BACKENDS),
+    )
+    parser.add_argument("-m", "--model", help="Model (default: medium)", default="medium")
+    parser.add_argument(
+        "-l",
+        "--language",
+        help="Language (default: MMDIARY_TRANSCRIBE_LANGUAGE or ru)",
+        default=os.getenv("MMDIARY_TRANSCRIBE_LANGUAGE", "ru"),
+    )
+    parser.add_argument("-t", "--threads", help="Threads (default: auto)", type=int, default=0)
+    parser.add_argument("-r", "--repeat", help="Repeats (default: 1)", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = __args_parse()
+    log.init_logger()
+
+    print(f"{'backend':16} {'load,s':>8} {'time,s':>8} {'audio,s':>8} {'speed':>7} segments chars")
+    for backend in args.backends:
+        try:
+            res = benchmark(
+                (backend, args.model, args.threads), args.files, args.language, args.repeat
+            )
+        except UserWarning as ex:
+            print(f"{backend:16} {ex}")
+            continue
+        speed = res["audio"] / res["time"] if res["time"] else 0
+        print(
+            f"{backend:16} {res['load']:8.1f} {res['time']:8.1f} {res['audio']:8.1f}"
+            f" {speed:6.1f}x {res['segments']:8} {res['chars']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# pylint: disable=too-few-public-methods
+
+import json
+import logging
+import os
+import socket
+
+
+def socket_path():
+    path = os.getenv("MMDIARY_TRANSCRIBE_SOCKET")
+    return os.path.expanduser(path) if path else None
+
+
+class TranscriberClient:
+    """
+    Transcriber interface (process_list) over the service socket
+    """
+
+    def __init__(self, path):
+        self.__path = path
+
+    def process_list(self, fileslist):
+        """
+        Blocks until all files are transcribed, returns list of failed file names
+        """
+        fileslist = list(fileslist)
+        if len(fileslist) == 0:
+            return []
+        logging.info("Send %i files to the transcriber service", len(fileslist))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.__path)
+            request = {
+                "files": [mf.name() for mf in fileslist],
+                # files which are transcribed again (see TranscriberService.process)
+                "existing": [mf.name() for mf in fileslist if mf.have_json()],
+            }
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("r", encoding="utf-8") as f:
+                line = f.readline()
+        if not line:
+            raise UserWarning("Transcriber service closed connection")
+        res = json.loads(line)
+        if "error" in res:
+            raise UserWarning(f"Transcriber service error: {res['error']}")
+        logging.info("Transcribed by the service: %i, failed: %i", res["done"], len(res["failed"]))
+        return res["failed"]
+
+
+def connect():
+    """
+    Returns client of the running service or None
+    """
+    path = socket_path()
+    if path is None:
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+    except OSError:
+        logging.warning("Transcriber service is not available: %s", path)
+        return None
+    return TranscriberClient(path)
@@ -34,7 +34,7 @@ def main():
 
     for path in args.inpath:
         lib = medialib.MediaLib(path)
-        process_list(lib.get_processed(should_have_file=False), args.text)
+        process_list(lib.iter_processed(should_have_file=False), args.text)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import logging
+import os
+import socketserver
+import threading
+
+from mmdiary.utils import log, medialib
+from mmdiary.transcriber import client
+from mmdiary.transcriber.transcriber import Transcriber
+
+DESCRIPTION = """
+Transcriber service: keeps the model loaded and transcribes files on request
+of the other tools (mmdiary, mmdiary-transcriber-run), so they don't load the model.
+Jobs from several clients are queued and processed one by one, results are saved
+to json files as usual.
+Please declare enviromnent variables before use:
+    MMDIARY_TRANSCRIBE_SOCKET - Service Unix socket path, clients use the service
+        if this variable is set and the service is running
+Optional environment variables:
+    MMDIARY_TRANSCRIBE_MODEL, MMDIARY_TRANSCRIBE_LANGUAGE, MMDIARY_TRANSCRIBE_BACKEND,
+    MMDIARY_TRANSCRIBE_WORKERS, MMDIARY_TRANSCRIBE_THREADS - see mmdiary-transcriber-run
+"""
+
+
+class TranscriberService:
+    def __init__(self, transcriber):
+        self.__transcriber = transcriber
+        # the model is used by one job at a time
+        self.__lock = threading.Lock()
+
+    def process(self, filenames, existing=()):
+        """
+        existing - files which had json on request (see TranscriberClient.process_list),
+            they are transcribed again
+        Returns (transcribed count, failed file names)
+        """
+        existing = set(existing)
+        with self.__lock:
+            files = [medialib.MediaFile(f) for f in filenames]
+            # skip files transcribed by request of another client while this job waited
+            files = [
+                mf
+                for mf in files
+                if mf.have_file() and (mf.name() in existing or not mf.have_json())
+            ]
+            self.__transcriber.process_list(files)
+            failed = [mf.name() for mf in files if not medialib.MediaFile(mf.name()).have_json()]
+        return len(files) - len(failed), failed
+
+    def serve(self, path):
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    # availability check
+                    return
+                try:
+                    request = json.loads(line)
+                    done, failed = service.process(request["files"], request.get("existing", ()))
+                    res = {"done": done, "failed": failed}
+                except Exception as ex:
+                    logging.exception("Transcriber job failed")
+                    res = {"error": str(ex)}
+                self.wfile.write(json.dumps(res).encode("utf-8") + b"\n")
+
+        if os.path.exists(path):
+            if client.connect() is not None:
+                raise UserWarning(f"Transcriber service is already running: {path}")
+            # stale socket of the stopped service
+            os.unlink(path)
+        # socket is accessible for the current user only
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        finally:
+            os.umask(umask)
+        with server:
+            logging.info("Transcriber service started: %s", path)
+            try:
+                server.serve_forever()
+            finally:
+                os.unlink(path)
+
+
+def __args_parse():
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("-l", "--logfile", help="Log file", default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = __args_parse()
+    log.init_logger(args.logfile)
+
+    path = client.socket_path()
+    if path is None:
+        raise UserWarning("MMDIARY_TRANSCRIBE_SOCKET is not set")
+
+    tr = Transcriber(
+        os.getenv("MMDIARY_TRANSCRIBE_MODEL", "medium"),
+        os.getenv("MMDIARY_TRANSCRIBE_LANGUAGE", "ru"),
+    )
+    TranscriberService(tr).serve(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,21 @@
 # pylint: disable=import-outside-toplevel,too-few-public-methods
 
 import argparse
+import collections
+import concurrent.futures
+import itertools
 import logging
+import multiprocessing
 import os
+import subprocess
 from datetime import datetime
 
 from photo_importer import fileprop
 
-from mmdiary.utils import log, medialib, progressbar
+from mmdiary.utils import fingerprint, log, medialib, progressbar
 from mmdiary.utils.medialib import TIME_OUT_FORMAT
 
+from mmdiary.transcriber import audio, backends, vad
 from mmdiary.transcriber.verifier import check_text
 
 DESCRIPTION = """
@@ -20,21 +26,173 @@ Optional environment variables:
     MMDIARY_TRANSCRIBE_MODEL - Transcribe model (default: "medium")
         See details: https://github.com/openai/whisper?tab=readme-ov-file#available-models-and-languages
     MMDIARY_TRANSCRIBE_LANGUAGE - Transcribe language (default: "ru")
+    MMDIARY_TRANSCRIBE_BACKEND - Inference backend (default: "whisper"):
+        whisper - openai-whisper (PyTorch, uses CUDA if available)
+        faster-whisper - CTranslate2 int8 inference, much faster on CPU
+            (requires faster-whisper package, see MMDIARY_TRANSCRIBE_COMPUTE_TYPE)
+    MMDIARY_TRANSCRIBE_WORKERS - Number of worker processes, each holds its own model
+        (default: 1 - transcribe in the main process)
+    MMDIARY_TRANSCRIBE_THREADS - Torch threads per worker
+        (default: 0 - CPU count divided by workers, torch default for single process)
+    MMDIARY_TRANSCRIBE_VAD - Transcribe only speech regions found by voice activity
+        detection, skipping silence (default: 0 - transcribe the whole file)
+    MMDIARY_TRANSCRIBE_DECODE_AHEAD - Number of next files decoded in background
+        while the current one is transcribed (default: 2)
+    MMDIARY_TRANSCRIBE_SOCKET - Transcriber service socket, if the service is running
+        files are transcribed by it (see mmdiary-transcriber-service)
+    MMDIARY_FINGERPRINT_INDEX - Content fingerprints index file, to reuse transcripts
+        of the moved/renamed media instead of transcribing them again
 """
 
+TRANSCRIBE_BACKEND = os.getenv("MMDIARY_TRANSCRIBE_BACKEND", backends.WhisperBackend.NAME)
+TRANSCRIBE_WORKERS = int(os.getenv("MMDIARY_TRANSCRIBE_WORKERS", "1"))
+TRANSCRIBE_THREADS = int(os.getenv("MMDIARY_TRANSCRIBE_THREADS", "0"))
+
+TRANSCRIBE_VAD = os.getenv("MMDIARY_TRANSCRIBE_VAD", "0") == "1"
+# nothing to skip if speech takes more of the file
+VAD_MAX_SPEECH_RATIO = 0.9
+
+# decoded audio takes ~230 MB per hour, so only a few files are kept ahead
+DECODE_AHEAD = max(int(os.getenv("MMDIARY_TRANSCRIBE_DECODE_AHEAD", "2")), 1)
+
+DURATION_THREADS = 8
+
+g_fingerprints = fingerprint.FingerprintIndex()
+
+# model of the pool worker process (see init_worker)
+g_worker = {}
+
+
+def transcribe_audio(model, samples, language):
+    """
+    Transcribes only speech regions of the audio samples (see vad.py),
+    segments times are remapped to the original timeline
+    The whole audio is transcribed if no speech found, VAD is not trusted to drop it
+    """
+    regions = vad.speech_regions(samples)
+    speech = sum(end - start for start, end in regions)
+    if speech == 0:
+        logging.info("No speech found, transcribe the whole audio")
+        return model.transcribe(samples, language)
+    if speech > len(samples) * VAD_MAX_SPEECH_RATIO:
+        return model.transcribe(samples, language)
+    logging.info("Transcribe speech only: %i%% of audio", speech * 100 // len(samples))
+    speech_audio = vad.SpeechAudio(samples, regions)
+    return speech_audio.remap_result(model.transcribe(speech_audio.audio, language))
+
+
+def transcribe_samples(model, samples, language):
+    if not TRANSCRIBE_VAD:
+        return model.transcribe(samples, language)
+    return transcribe_audio(model, samples, language)
+
+
+def transcribe_file(model, filename, language):
+    if not TRANSCRIBE_VAD:
+        return model.transcribe(filename, language)
+    return transcribe_audio(model, audio.decode_audio(filename), language)
+
+
+def init_worker(backend, model, language, threads):
+    g_worker["model"] = backends.create_backend(backend, model, threads)
+    g_worker["language"] = language
+
+
+def transcribe_in_worker(filename):
+    return transcribe_file(g_worker["model"], filename, g_worker["language"])
+
+
+def media_duration(filename):
+    """
+    Returns media duration in seconds (by ffprobe, installed along with ffmpeg) or None
+    """
+    try:
+        out = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                filename,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        return float(out.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+
+def media_type(file):
+    prop = file.prop()
+    if prop.type() == fileprop.AUDIO:
+        return "audio"
+    if prop.type() == fileprop.VIDEO:
+        return "video"
+    logging.info("Not audio file, skip")
+    return None
+
+
+def media_fields(file, tp):
+    """
+    Returns transcript fields describing the media file
+    """
+    prop = file.prop()
+    return {
+        "type": tp,
+        "source": os.path.split(file.name())[1],
+        "recordtime": prop.time().strftime(TIME_OUT_FORMAT) if prop.time() is not None else "",
+        "processtime": datetime.now().strftime(TIME_OUT_FORMAT),
+    }
+
+
+def longest_first(files):
+    """
+    Returns files ordered by media duration, longest first, so the pool doesn't
+    end with a single long file in progress
+    File size is used if duration of any file is unknown
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DURATION_THREADS) as pool:
+        durations = list(pool.map(media_duration, [f.name() for f in files]))
+    if None in durations:
+        durations = [os.path.getsize(f.name()) for f in files]
+    order = sorted(range(len(files)), key=lambda i: durations[i], reverse=True)
+    return [files[i] for i in order]
 
-class Transcriber:
-    def __init__(self, model, language):
-        import whisper
 
-        logging.info("Transcriber initialization...")
-        self.__model = whisper.load_model(model)
-        self.__modelname = "whisper/" + model
+class Transcriber:
+    def __init__(self, model, language, workers=None, threads=None, backend=None):
+        """
+        backend - inference backend name (MMDIARY_TRANSCRIBE_BACKEND)
+        workers - number of worker processes (MMDIARY_TRANSCRIBE_WORKERS),
+            with one worker files are transcribed in the current process
+        threads - torch threads per worker (MMDIARY_TRANSCRIBE_THREADS)
+        """
+        backend = backend if backend is not None else TRANSCRIBE_BACKEND
+        if backend not in backends.BACKENDS:
+            raise UserWarning(f"Incorrect transcribe backend: {backend}")
+        self.__modelname = backend + "/" + model
         self.__language = language
-        logging.info("Transcriber inited")
+        self.__workers = max(workers if workers is not None else TRANSCRIBE_WORKERS, 1)
+        self.__threads = threads if threads is not None else TRANSCRIBE_THREADS
+        self.__model = None
+        self.__model_args = (backend, model, self.__threads)
+        if self.__workers == 1:
+            self.__load_model()
+
+    def __load_model(self):
+        if self.__model is None:
+            logging.info("Transcriber initialization...")
+            self.__model = backends.create_backend(*self.__model_args)
+            logging.info("Transcriber inited")
 
     def __transcribe(self, file):
-        return self.__model.transcribe(file.name(), language=self.__language)
+        self.__load_model()
+        return transcribe_file(self.__model, file.name(), self.__language)
 
     def __extract_caption(self, text):
         res = ""
@@ -60,17 +218,13 @@ class Transcriber:
     def process(self, file):
         logging.info("Process file: %s", file)
 
-        prop = file.prop()
-        tp = ""
-        if prop.type() == fileprop.AUDIO:
-            tp = "audio"
-        elif prop.type() == fileprop.VIDEO:
-            tp = "video"
-        else:
-            logging.info("Not audio file, skip")
+        tp = media_type(file)
+        if tp is None:
             return
 
-        res = self.__transcribe(file)
+        self.__save(file, tp, self.__transcribe(file))
+
+    def __save(self, file, tp, res):
         text = self.__to_text(res)
         text = check_text(text, self.__language)
 
@@ -78,30 +232,189 @@ class Transcriber:
             "caption": self.__extract_caption(text),
             "text": text,
             "model": self.__modelname,
-            "type": tp,
-            "source": os.path.split(file.name())[1],
             "duration": self.__duration(res),
-            "recordtime": prop.time().strftime(TIME_OUT_FORMAT) if prop.time() is not None else "",
-            "processtime": datetime.now().strftime(TIME_OUT_FORMAT),
         }
+        cont.update(media_fields(file, tp))
 
         file.save_json(cont)
+        g_fingerprints.add(file.name(), file.json_name())
 
         logging.info("Saved to: %s", file.json_name())
 
+    def __save_logged(self, file, tp, res):
+        try:
+            self.__save(file, tp, res)
+        except Exception:
+            logging.exception("Transcribe failed: %s", file)
+
+    def __decode_ahead(self, fileslist):
+        """
+        Decodes audio of the next DECODE_AHEAD files on the background thread
+        while the consumer transcribes the current one
+        Yields (file, media type, decoded samples future), type is None for not media files
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            queue = collections.deque()
+            for af in medialib.prefetch_props(fileslist):
+                try:
+                    tp = media_type(af)
+                except Exception:
+                    logging.exception("Transcribe failed")
+                    tp = None
+                future = pool.submit(audio.decode_audio, af.name()) if tp is not None else None
+                queue.append((af, tp, future))
+                while len(queue) > DECODE_AHEAD:
+                    yield queue.popleft()
+            while queue:
+                yield queue.popleft()
+
     def process_list(self, fileslist):
-        pbar = progressbar.start("Transcribe", len(fileslist))
+        """
+        fileslist - list or iterable (e.g. MediaLib.iter_new), if length is unknown
+            the progress is shown without total
+        """
+        if self.__workers > 1:
+            self.__process_pool(list(fileslist))
+            return
 
-        for af in fileslist:
+        pbar = progressbar.start(
+            "Transcribe", len(fileslist) if hasattr(fileslist, "__len__") else None
+        )
+
+        # model works on the current file only: the next files are decoded
+        # in background and results are saved by the separate thread
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as saver:
+            for af, tp, samples in self.__decode_ahead(fileslist):
+                if tp is not None:
+                    logging.info("Process file: %s", af)
+                    try:
+                        self.__load_model()
+                        res = transcribe_samples(self.__model, samples.result(), self.__language)
+                        saver.submit(self.__save_logged, af, tp, res)
+                    except Exception:
+                        logging.exception("Transcribe failed: %s", af)
+                pbar.increment()
+
+        pbar.finish()
+
+    def __process_pool(self, fileslist):
+        """
+        Files are transcribed by the worker processes, longest first,
+        results are collected and saved by the current process
+        """
+        todo = []
+        for af in medialib.prefetch_props(fileslist):
             try:
-                self.process(af)
+                tp = media_type(af)
+                if tp is not None:
+                    todo.append((af, tp))
             except Exception:
                 logging.exception("Transcribe failed")
-            pbar.increment()
-
+        if len(todo) == 0:
+            return
+        types = {af.name(): tp for af, tp in todo}
+        todo = longest_first([af for af, _ in todo])
+
+        workers = min(self.__workers, len(todo))
+        threads = self.__threads
+        if threads <= 0:
+            threads = max((os.cpu_count() or 1) // workers, 1)
+        logging.info("Start %i transcriber workers, %i threads each", workers, threads)
+
+        pbar = progressbar.start("Transcribe", len(todo))
+        # spawn: torch is not fork-safe
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.__model_args[0], self.__model_args[1], self.__language, threads),
+        ) as pool:
+            futures = {pool.submit(transcribe_in_worker, af.name()): af for af in todo}
+            for future in concurrent.futures.as_completed(futures):
+                af = futures[future]
+                try:
+                    self.__save(af, types[af.name()], future.result())
+                except Exception:
+                    logging.exception("Transcribe failed: %s", af)
+                pbar.increment()
         pbar.finish()
 
 
+def reuse_transcript(file):
+    """
+    Copies transcript of the same content from the other path (see FingerprintIndex),
+    returns True if the transcript was reused
+    Transcript is moved if its original media file no longer exists
+    Media fields (record time, etc.) are set according to the new path
+    """
+    found = g_fingerprints.find(file.name())
+    if found is None or found[0] == file.name():
+        return False
+    src = medialib.MediaFile(*found)
+    if not src.have_json():
+        return False
+    tp = media_type(file)
+    if tp is None:
+        return False
+    cont = src.load_json()
+    cont.update(media_fields(file, tp))
+    file.save_json(cont)
+    if not os.path.exists(src.name()):
+        src.remove_json()
+    g_fingerprints.add(file.name(), file.json_name())
+    logging.info("Transcript reused: %s -> %s", src.json_name(), file.json_name())
+    return True
+
+
+def register_transcripts(lib):
+    """
+    Registers all processed files of the library in the fingerprints index,
+    files known by the index (unchanged size and mtime) are not read again
+    """
+    for mf in lib.iter_processed():
+        try:
+            g_fingerprints.add(mf.name(), mf.json_name())
+        except OSError as ex:
+            logging.warning("Fingerprint failed: %s: %s", mf.name(), ex)
+
+
+def skip_reused(fileslist, lib=None):
+    """
+    Filters out files, which transcripts were reused
+    Processed files of the library (if specified) are registered before the first
+    file check, so nothing is done if there are no files
+    """
+    if not g_fingerprints.enabled():
+        yield from fileslist
+        return
+    for mf in fileslist:
+        if lib is not None:
+            register_transcripts(lib)
+            lib = None
+        try:
+            if reuse_transcript(mf):
+                continue
+        except OSError as ex:
+            logging.warning("Transcript reuse failed: %s: %s", mf.name(), ex)
+        yield mf
+
+
+def create_transcriber():
+    """
+    Returns client of the running transcriber service (see service.py),
+    if it is not available the model is loaded in the current process
+    """
+    from mmdiary.transcriber import client
+
+    service = client.connect()
+    if service is not None:
+        return service
+    return Transcriber(
+        os.getenv("MMDIARY_TRANSCRIBE_MODEL", "medium"),
+        os.getenv("MMDIARY_TRANSCRIBE_LANGUAGE", "ru"),
+    )
+
+
 def __args_parse():
     parser = argparse.ArgumentParser(
         description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
@@ -116,21 +429,20 @@ def main():
     args = __args_parse()
     log.init_logger(args.logfile)
 
-    fileslist = []
+    fileslist = iter(())
     if os.path.isfile(args.inpath):
-        fileslist = (medialib.MediaFile(args.inpath),)
+        fileslist = iter((medialib.MediaFile(args.inpath),))
     elif os.path.isdir(args.inpath):
         lib = medialib.MediaLib(args.inpath)
-        fileslist = lib.get_all() if args.update else lib.get_new()
+        fileslist = lib.iter_all() if args.update else skip_reused(lib.iter_new(), lib)
 
-    if len(fileslist) == 0:
+    first = next(fileslist, None)
+    if first is None:
         return
+    fileslist = itertools.chain((first,), fileslist)
 
-    print("Model loading... ", end='', flush=True)
-    tr = Transcriber(
-        os.getenv("MMDIARY_TRANSCRIBE_MODEL", "medium"),
-        os.getenv("MMDIARY_TRANSCRIBE_LANGUAGE", "ru"),
-    )
+    print("Transcriber initialization... ", end='', flush=True)
+    tr = create_transcriber()
     print("done")
 
     tr.process_list(fileslist)
@@ -0,0 +1,118 @@
+import bisect
+
+import numpy as np
+
+from mmdiary.transcriber.audio import SAMPLE_RATE
+
+FRAME_SIZE = SAMPLE_RATE * 30 // 1000
+
+# frame is speech if its energy is above the noise floor (low percentile of
+# the frames energy) by the margin, and above the absolute floor
+NOISE_PERCENTILE = 10
+SPEECH_MARGIN_DB = 12
+MIN_SPEECH_DB = -55
+# loud frames level (high percentile of the frames energy) must be above the noise
+# floor by this contrast, otherwise speech can't be told from the background noise
+# and the whole audio is treated as speech
+SPEECH_PERCENTILE = 99
+MIN_CONTRAST_DB = 20
+
+# pauses shorter than this are kept inside the speech region (seconds)
+MIN_SILENCE = 1.0
+# speech regions shorter than this are dropped as clicks/noise (seconds)
+MIN_SPEECH = 0.2
+# context kept around each speech region (seconds)
+PADDING = 0.3
+# silence inserted between joined regions, so they are not merged into one sentence
+GAP = 0.5
+
+
+def frames_energy(audio):
+    """
+    Returns RMS energy (dBFS) of each FRAME_SIZE frame
+    """
+    count = len(audio) // FRAME_SIZE
+    frames = audio[: count * FRAME_SIZE].reshape(count, FRAME_SIZE)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_regions(audio):
+    """
+    Returns list of (start, end) samples of the speech regions,
+    single region of the whole audio if speech is not separable from the noise
+    """
+    energy = frames_energy(audio)
+    if len(energy) == 0:
+        return []
+    noise, level = np.percentile(energy, [NOISE_PERCENTILE, SPEECH_PERCENTILE])
+    if level < MIN_SPEECH_DB:
+        return []
+    if level - noise < MIN_CONTRAST_DB:
+        return [(0, len(audio))]
+    threshold = max(noise + SPEECH_MARGIN_DB, MIN_SPEECH_DB)
+    voiced = np.concatenate(([False], energy > threshold, [False]))
+    # frame indexes of the voiced runs starts and ends
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    runs = edges.reshape(-1, 2) * FRAME_SIZE
+
+    min_silence = int(MIN_SILENCE * SAMPLE_RATE)
+    regions = []
+    for start, end in runs.tolist():
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    padding = int(PADDING * SAMPLE_RATE)
+    res = []
+    for start, end in regions:
+        if end - start < MIN_SPEECH * SAMPLE_RATE:
+            continue
+        start = max(start - padding, 0)
+        end = min(end + padding, len(audio))
+        if res and start <= res[-1][1]:
+            res[-1] = (res[-1][0], end)
+        else:
+            res.append((start, end))
+    return res
+
+
+class SpeechAudio:
+    """
+    Speech regions of the audio joined together (separated by GAP of silence),
+    remaps times of the joined audio back to the original timeline
+    """
+
+    def __init__(self, audio, regions):
+        gap = np.zeros(int(GAP * SAMPLE_RATE), dtype=audio.dtype)
+        parts = []
+        self.__starts = []
+        self.__regions = []
+        pos = 0
+        for start, end in regions:
+            if parts:
+                parts.append(gap)
+                pos += len(gap)
+            parts.append(audio[start:end])
+            self.__starts.append(pos / SAMPLE_RATE)
+            self.__regions.append((start / SAMPLE_RATE, (end - start) / SAMPLE_RATE))
+            pos += end - start
+        self.audio = np.concatenate(parts) if parts else audio[:0]
+
+    def remap(self, time):
+        """
+        Returns original time of the joined audio time (times in gaps go to the region end)
+        """
+        i = max(bisect.bisect_right(self.__starts, time) - 1, 0)
+        start, length = self.__regions[i]
+        return start + min(max(time - self.__starts[i], 0), length)
+
+    def remap_result(self, res):
+        """
+        Remaps segments times of the backend transcription result
+        """
+        for s in res["segments"]:
+            s["start"] = self.remap(s["start"])
+            s["end"] = self.remap(s["end"])
+        return res
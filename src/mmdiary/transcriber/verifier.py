@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-instance-attributes,import-outside-toplevel
 
 import argparse
 import logging
@@ -7,10 +7,7 @@ import os
 import re
 from datetime import datetime
 
-from notion.client import NotionClient
-
 from mmdiary.utils import medialib, log
-from mmdiary.notion import cache
 
 DESCRIPTION = """
 Verify transcribed file(s).
@@ -144,6 +141,10 @@ def check_text(text, language):
 
 class Verifier:
     def __init__(self, dryrun, force, sync):
+        from notion.client import NotionClient
+
+        from mmdiary.notion import cache
+
         self.__dryrun = dryrun
         self.__force = force
         self.__sync_local = sync in ('all', 'local')
@@ -228,7 +229,7 @@ class Verifier:
             os.unlink(file.name())
         else:
             logging.warning("File %s don't exists", file.name())
-        os.unlink(file.json_name())
+        file.remove_json()
         logging.info("removed from fs")
 
     def process(self, file):
@@ -241,7 +242,7 @@ class Verifier:
         return RES_OK
 
     def __process_audio(self, file):
-        data = file.json()
+        data = file.load_json()
         res = True
         uploaded = self.__cache.check_existing_pages(data.get("source", ""))
         check_res = self.__check_audio_json(data)
@@ -273,7 +274,7 @@ class Verifier:
         return res
 
     def __process_video(self, file):
-        data = file.json()
+        data = file.load_json()
         res = True
         check_res = self.__check_video_json(data)
         if check_res != RES_OK:
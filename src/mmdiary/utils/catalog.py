@@ -0,0 +1,225 @@
+import os
+import array
+import atexit
+import math
+import pickle
+import sys
+import threading
+
+from mmdiary.utils import jsoncache, manifest
+
+CATALOG_VERSION = 1
+
+
+def __provider_account(cont):
+    provider = cont.get("provider")
+    return provider.get("account") if provider else None
+
+
+STR_COLUMNS = {
+    "type": lambda cont: cont.get("type"),
+    "recordtime": lambda cont: cont.get("recordtime"),
+    "recorddate": lambda cont: cont["recordtime"][:10] if "recordtime" in cont else None,
+    "state": lambda cont: cont.get("state"),
+    "source": lambda cont: cont.get("source"),
+    "processtime": lambda cont: cont.get("processtime"),
+    "account": __provider_account,
+}
+
+FLOAT_COLUMNS = {
+    "duration": lambda cont: cont.get("duration"),
+}
+
+BOOL_COLUMNS = {
+    "upload": lambda cont: cont.get("upload", True),
+}
+
+COLUMNS = tuple(STR_COLUMNS) + tuple(FLOAT_COLUMNS) + tuple(BOOL_COLUMNS)
+
+# columns which are copied from json as is
+FIELDS = frozenset(("type", "recordtime", "state", "source", "processtime"))
+
+
+def extract(cont):
+    """
+    Returns dict of columns values for json content
+    """
+    res = {}
+    for name, extract_column in STR_COLUMNS.items():
+        value = extract_column(cont)
+        res[name] = sys.intern(value) if isinstance(value, str) else None
+    for name, extract_column in FLOAT_COLUMNS.items():
+        value = extract_column(cont)
+        res[name] = None if value is None else float(value)
+    for name, extract_column in BOOL_COLUMNS.items():
+        res[name] = bool(extract_column(cont))
+    return res
+
+
+class Catalog:
+    """
+    Compact columnar catalog of the json sidecars metadata (see COLUMNS),
+    so the library can be filtered and grouped without loading the json files
+    Rows are validated by json file mtime
+    Stored next to the json cache (MMDIARY_CACHE + ".catalog"), in memory only if cache not set
+    """
+
+    def __init__(self):
+        filename = os.getenv("MMDIARY_CACHE")
+        if filename is not None:
+            self.__filename = os.path.expanduser(filename) + ".catalog"
+        else:
+            self.__filename = None
+        self.__columns = None
+        self.__rows = None
+        self.__checked = set()
+        self.__updated = set()
+        self.__removed = set()
+        self.__lock = threading.Lock()
+        atexit.register(self.save)
+
+    def __empty(self):
+        columns = {"path": [], "mtime": array.array("d")}
+        for name in STR_COLUMNS:
+            columns[name] = []
+        for name in FLOAT_COLUMNS:
+            columns[name] = array.array("d")
+        for name in BOOL_COLUMNS:
+            columns[name] = array.array("b")
+        return columns
+
+    def __read(self):
+        if self.__filename is None or not os.path.exists(self.__filename):
+            return self.__empty()
+        try:
+            with open(self.__filename, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # catalog is only an optimization, just rebuild it
+            return self.__empty()
+        if data.get("version") != CATALOG_VERSION:
+            return self.__empty()
+        columns = data["columns"]
+        for name in STR_COLUMNS:
+            columns[name] = [sys.intern(v) if v is not None else None for v in columns[name]]
+        return columns
+
+    def __load(self):
+        if self.__columns is None:
+            self.__columns = self.__read()
+            self.__rows = {path: row for row, path in enumerate(self.__columns["path"])}
+
+    def save(self):
+        """
+        Saves the catalog if changed (done automatically at exit)
+        Saving is done under the file lock and merged with the file content,
+        so rows saved by other processes in the meantime are kept
+        """
+        if self.__filename is None or not (self.__updated or self.__removed):
+            return
+        with self.__lock, jsoncache.file_lock(self.__filename):
+            current = self.__read()
+            rows = {
+                path: (current, row)
+                for row, path in enumerate(current["path"])
+                if path is not None and path not in self.__removed
+            }
+            for path in self.__updated:
+                row = self.__rows[path]
+                other = rows.get(path)
+                # other process could save newer version of the file
+                if other is None or other[0]["mtime"][other[1]] <= self.__columns["mtime"][row]:
+                    rows[path] = (self.__columns, row)
+
+            removed = set()
+            if jsoncache.sweep_due(self.__filename):
+                removed = self.__find_missing(rows)
+            columns = self.__empty()
+            for path, (source, row) in rows.items():
+                if path not in removed:
+                    for name, column in source.items():
+                        columns[name].append(column[row])
+
+            tmpfile = self.__filename + ".tmp"
+            with open(tmpfile, "wb") as f:
+                pickle.dump({"version": CATALOG_VERSION, "columns": columns}, f)
+            os.replace(tmpfile, self.__filename)
+            self.__columns = columns
+            self.__rows = {path: row for row, path in enumerate(columns["path"])}
+            self.__updated = set()
+            self.__removed = set()
+
+    def __find_missing(self, paths):
+        removed = jsoncache.find_missing(path for path in paths if path not in self.__checked)
+        # sidecars from manifests are validated by manifest mtime on access
+        manifest_dirs = {}
+        for path in list(removed):
+            dirname = os.path.dirname(path)
+            if dirname not in manifest_dirs:
+                manifest_dirs[dirname] = os.path.exists(
+                    os.path.join(dirname, manifest.MANIFEST_FILE)
+                )
+            if manifest_dirs[dirname]:
+                removed.discard(path)
+        return removed
+
+    def __value(self, name, row):
+        value = self.__columns[name][row]
+        if name in FLOAT_COLUMNS:
+            return None if math.isnan(value) else value
+        if name in BOOL_COLUMNS:
+            return bool(value)
+        return value
+
+    def get(self, jsonname, mtime):
+        """
+        Returns dict of columns values or None if the file is not cataloged or changed
+        """
+        with self.__lock:
+            self.__load()
+            row = self.__rows.get(jsonname)
+            if row is None or self.__columns["mtime"][row] != mtime:
+                return None
+            self.__checked.add(jsonname)
+            return {name: self.__value(name, row) for name in COLUMNS}
+
+    def set(self, jsonname, mtime, cont):
+        """
+        Updates the row from json content, returns dict of columns values
+        """
+        info = extract(cont)
+        with self.__lock:
+            self.__load()
+            columns = self.__columns
+            row = self.__rows.get(jsonname)
+            if row is None:
+                row = len(columns["path"])
+                self.__rows[jsonname] = row
+                columns["path"].append(jsonname)
+                columns["mtime"].append(mtime)
+                for name in STR_COLUMNS:
+                    columns[name].append(None)
+                for name in FLOAT_COLUMNS:
+                    columns[name].append(math.nan)
+                for name in BOOL_COLUMNS:
+                    columns[name].append(0)
+            columns["mtime"][row] = mtime
+            for name in STR_COLUMNS:
+                columns[name][row] = info[name]
+            for name in FLOAT_COLUMNS:
+                columns[name][row] = math.nan if info[name] is None else info[name]
+            for name in BOOL_COLUMNS:
+                columns[name][row] = 1 if info[name] else 0
+            self.__checked.add(jsonname)
+            self.__updated.add(jsonname)
+            self.__removed.discard(jsonname)
+        return info
+
+    def remove(self, jsonname):
+        with self.__lock:
+            self.__load()
+            row = self.__rows.pop(jsonname, None)
+            if row is not None:
+                self.__columns["path"][row] = None
+                self.__updated.discard(jsonname)
+                self.__removed.add(jsonname)
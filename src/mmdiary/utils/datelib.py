@@ -1,8 +1,11 @@
 #!/usr/bin/python3
 
 import argparse
+import bisect
+import contextlib
 import logging
 import os
+import re
 
 from fnmatch import fnmatch
 from collections import defaultdict
@@ -23,6 +26,7 @@ Possible actions:
     list_disabled_videos - List videos marked as disabled 
     set_reupload - Mark a video as not uploaded for future reupload
                    (e.g. if video was deleted on the YouTube)
+    set_state - Set state for all processed dates matched to the date mask
 """
 
 STATE_NONE = "none"
@@ -41,6 +45,71 @@ VALID_STATES = set(
     ]
 )
 
+PROCESSED_STATES = VALID_STATES - set([STATE_NONE])
+
+MASK_SPECIAL_CHARS_RE = re.compile(r"[*?\[]")
+
+
+class DateIndex:
+    """
+    Sorted set of dates, ranges and masks with constant prefix (e.g. 2024-03-*)
+    are resolved by bisect
+    """
+
+    def __init__(self, dates=()):
+        self.__dates = sorted(set(dates))
+
+    def __contains__(self, date):
+        pos = bisect.bisect_left(self.__dates, date)
+        return pos < len(self.__dates) and self.__dates[pos] == date
+
+    def __len__(self):
+        return len(self.__dates)
+
+    def __iter__(self):
+        return iter(self.__dates)
+
+    def add(self, date):
+        pos = bisect.bisect_left(self.__dates, date)
+        if pos == len(self.__dates) or self.__dates[pos] != date:
+            self.__dates.insert(pos, date)
+
+    def remove(self, date):
+        pos = bisect.bisect_left(self.__dates, date)
+        if pos < len(self.__dates) and self.__dates[pos] == date:
+            del self.__dates[pos]
+
+    def range(self, start=None, end=None):
+        """
+        Dates from start to end inclusive (None - unbounded)
+        """
+        lo = 0 if start is None else bisect.bisect_left(self.__dates, start)
+        hi = len(self.__dates) if end is None else bisect.bisect_right(self.__dates, end)
+        return self.__dates[lo:hi]
+
+    def __match_mask(self, mask):
+        prefix = MASK_SPECIAL_CHARS_RE.split(mask, 1)[0]
+        if prefix == mask:
+            return [mask] if mask in self else []
+        lo = bisect.bisect_left(self.__dates, prefix)
+        hi = bisect.bisect_left(self.__dates, prefix + chr(0x10FFFF))
+        return [date for date in self.__dates[lo:hi] if fnmatch(date, mask)]
+
+    def match(self, masks=None):
+        """
+        Sorted list of dates matched to any of fnmatch masks (all dates if no masks)
+        """
+        if not masks:
+            return list(self.__dates)
+        if isinstance(masks, str):
+            masks = [masks]
+        if len(masks) == 1:
+            return self.__match_mask(masks[0])
+        res = set()
+        for mask in masks:
+            res.update(self.__match_mask(mask))
+        return sorted(res)
+
 
 class DateLib:
     def __init__(self):
@@ -55,42 +124,79 @@ class DateLib:
         )
         self.__res_dir = os.path.expanduser(os.environ["MMDIARY_VIDEO_RES_DIR"])
         self.__results = None
+        self.__results_index = None
+        self.__states = None
         self.__sources = None
+        self.__sources_index = None
 
     def __load_results(self):
         res = {}
         logging.debug("Process results: %s", self.__res_dir)
-        lib = medialib.MediaLib(self.__res_dir)
-        for mf in lib.get_processed(should_have_file=False):
+        lib = medialib.MediaLib(self.__res_dir, metadata_only=True)
+        for mf in medialib.prefetch(lib.get_processed(should_have_file=False)):
             res[mf.recorddate()] = mf
         return res
 
     def __load_sources(self):
         res = defaultdict(lambda: [])
-        for path in self.__scan_paths:
-            logging.debug("Process sources: %s", path)
-            lib = medialib.MediaLib(path)
-            for mf in lib.get_processed():
-                res[mf.recorddate()].append(mf)
+        logging.debug("Process sources: %s", self.__scan_paths)
+        lib = medialib.MediaLib(self.__scan_paths, metadata_only=True)
+        for mf in medialib.prefetch(lib.get_processed()):
+            res[mf.recorddate()].append(mf)
         return res
 
     def results(self):
         if self.__results is None:
             self.__results = self.__load_results()
+            self.__results_index = DateIndex(self.__results.keys())
+            self.__states = defaultdict(DateIndex)
+            for date, mf in self.__results.items():
+                self.__states[mf.state()].add(date)
         return self.__results
 
     def sources(self):
         if self.__sources is None:
             self.__sources = self.__load_sources()
+            self.__sources_index = DateIndex(self.__sources.keys())
         return self.__sources
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Apply many changes with one grouped flush (see medialib.transaction),
+        on exception nothing is written and dates are reloaded on the next access
+        """
+        try:
+            with medialib.transaction():
+                yield
+        except BaseException:
+            self.__results = None
+            self.__results_index = None
+            self.__states = None
+            self.__sources = None
+            self.__sources_index = None
+            raise
+
+    def __update_result(self, date, fields):
+        """
+        Update result fields with keeping state indexes actual
+        """
+        mf = self.results()[date]
+        old_state = mf.state() if mf.have_json() else None
+        mf.update_fields(fields)
+        if date not in self.__results_index:
+            self.__results_index.add(date)
+        else:
+            self.__states[old_state].remove(date)
+        self.__states[mf.state()].add(date)
+
     def get_state(self, date):
         if date in self.results():
             return self.results()[date].state()
         return STATE_NONE
 
     def set_not_processed(self, date):
-        self.results()[date].update_fields({"state": STATE_NONE})
+        self.__update_result(date, {"state": STATE_NONE})
 
     def set_in_progress(self, date):
         fields = {"state": STATE_INPROCESS}
@@ -101,58 +207,49 @@ class DateLib:
             )
             fields["recordtime"] = date
             fields["type"] = "mergedvideo"
-        self.results()[date].update_fields(fields)
+        self.__update_result(date, fields)
 
     def set_converted(self, date, fields):
         new_fields = {}
         if fields is not None:
             new_fields.update(fields)
         new_fields["state"] = STATE_CONVERTED
-        self.results()[date].update_fields(new_fields)
+        self.__update_result(date, new_fields)
 
     def set_uploaded(self, date, provider, for_verification=False):
-        self.results()[date].update_fields(
+        self.__update_result(
+            date,
             {
                 "state": STATE_UPLOAD_VERIFICATION if for_verification else STATE_UPLOADED,
                 "provider": provider,
-            }
+            },
         )
 
     def set_state(self, date, state):
         if state not in VALID_STATES:
             raise UserWarning(f"Incorrect state: {state}")
-        self.results()[date].update_fields({"state": state})
+        self.__update_result(date, {"state": state})
 
     def get_nonprocessed(self, masks=None):
-        all_dates = set(self.sources().keys())
-        processed_dates = set(self.__get_results_dates_by_state(VALID_STATES - set([STATE_NONE])))
-        return sorted(self.__filter_by_masks(list(all_dates - processed_dates), masks))
-
-    def __filter_by_masks(self, dates, masks):
-        if masks is None or len(masks) == 0 or dates is None or len(dates) == 0:
-            return dates
-        if isinstance(next(iter(dates)), tuple):
-            return filter(lambda date: any(fnmatch(date[0], mask) for mask in masks), dates)
-        return filter(lambda date: any(fnmatch(date, mask) for mask in masks), dates)
-
-    def __filter_by_account(self, results, account):
-        if account is None:
-            return results
-        res = {}
-        for date, mf in results.items():
-            if "provider" in mf.json() and mf.json()["provider"]["account"] == account:
-                res[date] = mf
-        return res
+        self.sources()
+        return [
+            date
+            for date in self.__sources_index.match(masks)
+            if self.get_state(date) not in PROCESSED_STATES
+        ]
 
     def __get_results_dates_by_state(self, states, masks=None, account=None):
         for state in states:
             if state not in VALID_STATES:
                 raise UserWarning(f"Incorrect state: {state}")
+        results = self.results()
         res = []
-        for date, mf in self.__filter_by_account(self.results(), account).items():
-            if mf.state() in states:
-                res.append(date)
-        return sorted(self.__filter_by_masks(res, masks))
+        for state in set(states):
+            if state in self.__states:
+                res += self.__states[state].match(masks)
+        if account is not None:
+            res = [date for date in res if results[date].info()["account"] == account]
+        return sorted(res)
 
     def get_converted(self, masks=None):
         return self.__get_results_dates_by_state([STATE_CONVERTED], masks)
@@ -165,7 +262,7 @@ class DateLib:
     def get_files_by_date(self, date, for_upload=False):
         mfs = self.sources()[date]
         if for_upload:
-            mfs = list(filter(lambda mf: mf.json().get("upload", True), mfs))
+            mfs = list(filter(lambda mf: mf.info()["upload"], mfs))
         mfs.sort(key=lambda mf: mf.recordtime())
         return mfs
 
@@ -174,17 +271,18 @@ class DateLib:
         Find source file by part of name or by full name
         If part matched for many files, returns None
         """
-        res = None
-        for mfs in self.sources().values():
-            for mf in mfs:
-                if subfilename == mf.name():
-                    return mf
-                if subfilename in mf.name():
-                    if res is None:
-                        res = mf
-                    else:
-                        return None
-        return res
+        mfs = None
+        if self.__sources is None:
+            mfs = medialib.MediaLib(self.__scan_paths, metadata_only=True).find(subfilename)
+        if mfs is None:
+            # index is not built yet or out of date
+            mfs = [
+                mf for files in self.sources().values() for mf in files if subfilename in mf.name()
+            ]
+        for mf in mfs:
+            if subfilename == mf.name():
+                return mf
+        return mfs[0] if len(mfs) == 1 else None
 
     def disable_video(self, filename):
         if filename is None:
@@ -201,15 +299,18 @@ class DateLib:
         logging.info("Video file %s disabled", mf.name())
 
     def disable_date(self, date, reason):
-        mf = self.results()[date]
-        mf.update_fields({"state": STATE_CONVERTED, "upload": False, "disabled_by": reason})
-        logging.info("Date %s was disabled", mf.name())
+        self.__update_result(
+            date, {"state": STATE_CONVERTED, "upload": False, "disabled_by": reason}
+        )
+        logging.info("Date %s was disabled", self.results()[date].name())
 
     def list_dates(self, state, masks, account=None):
         if state is None:
-            res = {date: STATE_NONE for date in set(self.sources().keys())}
-            res.update({date: mf.state() for date, mf in self.results().items()})
-            return sorted(self.__filter_by_masks(res.items(), masks))
+            results = self.results()
+            self.sources()
+            res = {date: STATE_NONE for date in self.__sources_index.match(masks)}
+            res.update({date: results[date].state() for date in self.__results_index.match(masks)})
+            return sorted(res.items())
 
         if state == STATE_NONE:
             return [(date, STATE_NONE) for date in self.get_nonprocessed(masks)]
@@ -222,16 +323,28 @@ class DateLib:
         res = []
         for mfs in self.sources().values():
             for mf in mfs:
-                if not mf.json().get("upload", True):
+                if not mf.info()["upload"]:
                     res.append(mf.name())
         res.sort()
         return res
 
     def set_reupload(self, masks, account=None):
         dates = self.__get_results_dates_by_state([STATE_UPLOADED], masks, account)
-        for date in dates:
-            self.set_converted(date, {})
-            logging.info("%s marked to reupload", date)
+        with self.transaction():
+            for date in dates:
+                self.set_converted(date, {})
+                logging.info("%s marked to reupload", date)
+        return len(dates)
+
+    def set_states(self, masks, state, account=None):
+        """
+        Set state for all processed dates matched to the masks in one transaction
+        """
+        dates = self.__get_results_dates_by_state(VALID_STATES, masks, account)
+        with self.transaction():
+            for date in dates:
+                self.set_state(date, state)
+        logging.info("%i dates set to %s", len(dates), state)
         return len(dates)
 
 
@@ -251,14 +364,19 @@ def __args_parse():
             "disable_video",
             "disable_date",
             "set_reupload",
+            "set_state",
         ],
     )
     parser.add_argument("-f", "--file", help="File name (for disable_video)")
     parser.add_argument(
-        "-e", "--date", help="Date (for set_reupload, list_files, list_dates, disable_date)"
+        "-e",
+        "--date",
+        help="Date (for set_reupload, set_state, list_files, list_dates, disable_date)",
+    )
+    parser.add_argument("-s", "--state", help="State for (list_dates, set_state)")
+    parser.add_argument(
+        "--account", help="Provider account (for set_reupload, set_state, list_dates)"
     )
-    parser.add_argument("-s", "--state", help="State for (list_dates)")
-    parser.add_argument("--account", help="Provider account (for set_reupload, list_dates)")
     return parser.parse_args()
 
 
@@ -293,6 +411,11 @@ def main():
     elif args.action == "set_reupload":
         cnt = lib.set_reupload(args.date, args.account)
         print("Total:", cnt)
+    elif args.action == "set_state":
+        if args.date is None or args.state is None:
+            raise UserWarning("Date mask and state should be specified")
+        cnt = lib.set_states(args.date, args.state, args.account)
+        print("Total:", cnt)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+import os
+import atexit
+import hashlib
+import pickle
+import threading
+
+from mmdiary.utils import jsoncache
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLES_COUNT = 3
+
+
+def fingerprint(filename, size=None):
+    """
+    Content fingerprint: file size and hash of the blocks sampled
+    from the beginning, the middle and the end of the file
+    """
+    if size is None:
+        size = os.path.getsize(filename)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as f:
+        if size <= SAMPLE_SIZE * SAMPLES_COUNT:
+            digest.update(f.read())
+        else:
+            for pos in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+                f.seek(pos)
+                digest.update(f.read(SAMPLE_SIZE))
+    return f"{size}:{digest.hexdigest()}"
+
+
+class FingerprintIndex:
+    """
+    Persistent index of the transcribed media content fingerprints,
+    allows to recognize already transcribed content under the new path
+    Enabled if the index file is specified by MMDIARY_FINGERPRINT_INDEX
+    Keeps for each media path its (size, mtime_ns, fingerprint), so files
+    are hashed only once, and for each fingerprint its (media path, json path)
+    """
+
+    def __init__(self):
+        filename = os.getenv("MMDIARY_FINGERPRINT_INDEX")
+        if filename is not None:
+            self.__filename = os.path.expanduser(filename)
+        else:
+            self.__filename = None
+        self.__data = None
+        self.__updated = {"files": set(), "transcripts": set()}
+        self.__lock = threading.Lock()
+        atexit.register(self.save)
+
+    def enabled(self):
+        return self.__filename is not None
+
+    def __read(self):
+        if self.__filename is None or not os.path.exists(self.__filename):
+            return {"files": {}, "transcripts": {}}
+        try:
+            with open(self.__filename, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # index is only an optimization, just rebuild it
+            return {"files": {}, "transcripts": {}}
+
+    def __load(self):
+        if self.__data is None:
+            self.__data = self.__read()
+
+    def save(self):
+        """
+        Saves the index if changed (done automatically at exit)
+        Saving is done under the file lock and merged with the file content,
+        so entries saved by other processes in the meantime are kept
+        """
+        if self.__filename is None or not (
+            self.__updated["files"] or self.__updated["transcripts"]
+        ):
+            return
+        with self.__lock, jsoncache.file_lock(self.__filename):
+            data = self.__read()
+            for kind, keys in self.__updated.items():
+                for key in keys:
+                    data[kind][key] = self.__data[kind][key]
+            tmpfile = self.__filename + ".tmp"
+            with open(tmpfile, "wb") as f:
+                pickle.dump(data, f)
+            os.replace(tmpfile, self.__filename)
+            self.__data = data
+            self.__updated = {"files": set(), "transcripts": set()}
+
+    def get(self, filename):
+        """
+        Returns fingerprint of the file, the file is hashed only if it was changed
+        """
+        st = os.stat(filename)
+        with self.__lock:
+            self.__load()
+            entry = self.__data["files"].get(filename)
+        if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+            return entry[2]
+        res = fingerprint(filename, st.st_size)
+        with self.__lock:
+            self.__data["files"][filename] = (st.st_size, st.st_mtime_ns, res)
+            self.__updated["files"].add(filename)
+        return res
+
+    def add(self, filename, jsonname):
+        """
+        Register transcript of the media file
+        """
+        if not self.enabled():
+            return
+        fprint = self.get(filename)
+        with self.__lock:
+            if self.__data["transcripts"].get(fprint) != (filename, jsonname):
+                self.__data["transcripts"][fprint] = (filename, jsonname)
+                self.__updated["transcripts"].add(fprint)
+
+    def find(self, filename):
+        """
+        Returns (media path, json path) of the transcript of the same content or None
+        """
+        if not self.enabled():
+            return None
+        fprint = self.get(filename)
+        with self.__lock:
+            return self.__data["transcripts"].get(fprint)
@@ -0,0 +1,109 @@
+# pylint: disable=too-few-public-methods
+
+import logging
+import re
+
+IGNORE_FILE = ".mmdiaryignore"
+
+
+class IgnoreRules:
+    """
+    Gitignore-style rules
+    Supported: comments, negation (!), anchored (/) and directory only (trailing /) patterns,
+    wildcards: *, ?, [...], **
+    """
+
+    def __init__(self, patterns):
+        self.__rules = []
+        for pattern in patterns:
+            pattern = pattern.rstrip("\n").rstrip()
+            if pattern == "" or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if pattern == "":
+                continue
+            anchored = "/" in pattern
+            pattern = pattern.lstrip("/")
+            regex = self.__translate(pattern)
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            self.__rules.append((re.compile(regex + "$"), negate, dir_only))
+
+    def __translate(self, pattern):
+        res = ""
+        i = 0
+        n = len(pattern)
+        while i < n:
+            if pattern.startswith("**/", i):
+                res += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("/**", i) and i + 3 == n:
+                res += "/.*"
+                i += 3
+            elif pattern.startswith("**", i):
+                res += ".*"
+                i += 2
+            elif pattern[i] == "*":
+                res += "[^/]*"
+                i += 1
+            elif pattern[i] == "?":
+                res += "[^/]"
+                i += 1
+            elif pattern[i] == "[":
+                end = pattern.find("]", i + 1)
+                if end < 0:
+                    res += re.escape(pattern[i])
+                    i += 1
+                else:
+                    cls = pattern[i + 1 : end]
+                    if cls.startswith("!"):
+                        cls = "^" + cls[1:]
+                    res += "[" + cls.replace("\\", "\\\\") + "]"
+                    i = end + 1
+            else:
+                res += re.escape(pattern[i])
+                i += 1
+        return res
+
+    def match(self, relpath, is_dir):
+        """
+        Returns True if path ignored, False if explicitly included
+        and None if no rule matched
+        """
+        res = None
+        for regex, negate, dir_only in self.__rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                res = not negate
+        return res
+
+
+def load(filename):
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            return IgnoreRules(f.readlines())
+    except (OSError, UnicodeDecodeError) as err:
+        logging.error("ignore file load error: %s", err)
+        return IgnoreRules(())
+
+
+def is_ignored(chain, relpath, is_dir):
+    """
+    Check path against chain of (base, rules), where base is a path of the directory
+    rules belong to (relative to the library root), deeper rules have priority
+    """
+    res = None
+    for base, rules in chain:
+        if base != "":
+            relpath_base = relpath[len(base) + 1 :]
+        else:
+            relpath_base = relpath
+        match = rules.match(relpath_base, is_dir)
+        if match is not None:
+            res = match
+    return bool(res)
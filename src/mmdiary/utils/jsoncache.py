@@ -1,37 +1,489 @@
+# pylint: disable=too-few-public-methods
+
 import os
 import copy
 import pickle
 import json
 import atexit
+import contextlib
+import fcntl
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping, Sequence
 
+SQLITE_HEADER = b"SQLite format 3\x00"
+SQLITE_BUSY_TIMEOUT = 60
+# other process could save newer version of the file, keep it
+SQLITE_UPSERT = """INSERT INTO jsoncache (filename, mtime, data, atime, size)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(filename) DO UPDATE SET
+        mtime=excluded.mtime, data=excluded.data, atime=excluded.atime, size=excluded.size
+    WHERE excluded.mtime >= jsoncache.mtime"""
+# last access time is stored with this resolution (like relatime),
+# so runs which only read the cache don't need to save it
+ATIME_RESOLUTION = 24 * 60 * 60
+# entries of removed files are swept (all cached paths are stat'ed) not often than this
+SWEEP_INTERVAL = float(os.getenv("MMDIARY_CACHE_SWEEP_INTERVAL", "7")) * 24 * 60 * 60
 
-class JsonCache:
-    def __init__(self):
-        filename = os.getenv("MMDIARY_CACHE")
-        if filename is not None:
-            self.__filename = os.path.expanduser(filename)
-        else:
-            self.__filename = None
+
+def fsync(path):
+    """
+    Sync file or directory to disk
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def remove_files(filenames):
+    for filename in filenames:
+        try:
+            os.unlink(filename)
+        except FileNotFoundError:
+            pass
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """
+    Inter-process exclusive lock, associated with the file
+    """
+    with open(filename + ".lock", "wb") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CacheLimits:
+    """
+    Optional cache bounds, least recently used entries are evicted first
+    max_entries - number of entries
+    max_size - total size of cached JSON data in bytes
+    max_age - seconds since the last access
+    """
+
+    def __init__(self, max_entries=None, max_size=None, max_age=None):
+        self.__max_entries = max_entries
+        self.__max_size = max_size
+        self.__max_age = max_age
+
+    def evicted(self, entries, now):
+        """
+        entries - iterable of (filename, atime, size)
+        Returns set of filenames to remove
+        """
+        res = set()
+        keep = []
+        for filename, atime, size in entries:
+            if self.__max_age is not None and now - atime > self.__max_age:
+                res.add(filename)
+            else:
+                keep.append((atime, size, filename))
+        if self.__max_entries is None and self.__max_size is None:
+            return res
+
+        keep.sort(reverse=True)
+        total = 0
+        for count, (atime, size, filename) in enumerate(keep, 1):
+            total += size
+            if (self.__max_entries is not None and count > self.__max_entries) or (
+                self.__max_size is not None and total > self.__max_size
+            ):
+                res.add(filename)
+        return res
+
+
+def limits_from_env():
+    def getenv(name, scale):
+        value = os.getenv(name)
+        if value is None:
+            return None
+        try:
+            return float(value) * scale
+        except ValueError as ex:
+            raise UserWarning(f"Incorrect {name} value: {value}") from ex
+
+    return CacheLimits(
+        max_entries=getenv("MMDIARY_CACHE_MAX_ENTRIES", 1),
+        max_size=getenv("MMDIARY_CACHE_MAX_SIZE", 1024 * 1024),
+        max_age=getenv("MMDIARY_CACHE_MAX_AGE", 24 * 60 * 60),
+    )
+
+
+def find_missing(filenames):
+    """
+    Returns cached files which no longer exist
+    Files in not existing directories are kept, their storage can be just not mounted
+    """
+    res = set()
+    dirs = {}
+    for filename in filenames:
+        if os.path.exists(filename):
+            continue
+        dirname = os.path.dirname(filename)
+        if dirname not in dirs:
+            dirs[dirname] = os.path.isdir(dirname)
+        if dirs[dirname]:
+            res.add(filename)
+    return res
+
+
+def sweep_due(filename):
+    """
+    Returns True if removed files sweep of the cache file was not done for SWEEP_INTERVAL,
+    the sweep is marked as done (by the mtime of the stamp file next to the cache)
+    """
+    stamp = filename + ".sweep"
+    try:
+        if time.time() - os.stat(stamp).st_mtime < SWEEP_INTERVAL:
+            return False
+    except FileNotFoundError:
+        pass
+    with open(stamp, "wb"):
+        pass
+    os.utime(stamp)
+    return True
+
+
+class ReadOnlyDict(Mapping):
+    """
+    Read-only view of the cached JSON object, nested values are wrapped on access
+    """
+
+    def __init__(self, data):
+        self.__data = data
+
+    def __getitem__(self, key):
+        return freeze(self.__data[key])
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def __iter__(self):
+        return iter(self.__data)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __repr__(self):
+        return repr(self.__data)
+
+
+class ReadOnlyList(Sequence):
+    """
+    Read-only view of the cached JSON array, nested values are wrapped on access
+    """
+
+    def __init__(self, data):
+        self.__data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self.__data[index])
+        return freeze(self.__data[index])
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self.__data)
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return ReadOnlyDict(value)
+    if isinstance(value, list):
+        return ReadOnlyList(value)
+    return value
+
+
+def thaw(value):
+    """
+    Mutable deep copy of the (possible read-only) JSON value
+    """
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, ReadOnlyList)):
+        return [thaw(v) for v in value]
+    return value
+
+
+class PickleStorage:
+    """
+    Whole cache in one pickle file, loaded on first access and saved at exit
+    Saving is done under the file lock and merged with the file content,
+    so changes made by other processes in the meantime are kept
+    Entry: (mtime, cont, atime, size)
+    """
+
+    # returned objects are shared with the storage, so they must be copied before mutation
+    SHARED = True
+
+    def __init__(self, filename, limits=None):
+        self.__filename = filename
+        self.__limits = limits if limits is not None else CacheLimits()
         self.__data = None
-        self.__changed = False
-        atexit.register(self.__save)
+        self.__changed = set()
+        self.__removed = set()
+        self.__accessed = {}
+        self.__lock = threading.Lock()
+
+    def __read(self):
+        if self.__filename is None or not os.path.exists(self.__filename):
+            return {}
+        with open(self.__filename, "rb") as f:
+            data = pickle.load(f)
+        now = time.time()
+        for filename, entry in data.items():
+            if len(entry) == 2:
+                # saved by the previous version, without access time and size
+                data[filename] = entry + (now, len(json.dumps(entry[1], ensure_ascii=False)))
+        return data
 
     def __load(self):
-        if self.__data is not None:
+        if self.__data is None:
+            self.__data = self.__read()
+
+    def get(self, filename):
+        with self.__lock:
+            self.__load()
+            entry = self.__data.get(filename)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry[2] > ATIME_RESOLUTION:
+                self.__accessed[filename] = now
+            return entry[:2]
+
+    def set(self, filename, mtime, cont, size):
+        with self.__lock:
+            self.__load()
+            self.__data[filename] = (mtime, cont, time.time(), size)
+            self.__changed.add(filename)
+            self.__removed.discard(filename)
+
+    def remove(self, filename):
+        with self.__lock:
+            self.__load()
+            if filename in self.__data:
+                del self.__data[filename]
+                self.__changed.discard(filename)
+                self.__removed.add(filename)
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        if self.__filename is None or not (self.__changed or self.__removed or self.__accessed):
             return
-        if self.__filename is None or not os.path.exists(self.__filename):
-            self.__data = {}
+        with file_lock(self.__filename):
+            data = self.__read()
+            for filename in self.__removed:
+                data.pop(filename, None)
+            for filename in self.__changed:
+                entry = self.__data[filename]
+                current = data.get(filename)
+                # other process could save newer version of the file
+                if current is None or current[0] <= entry[0]:
+                    data[filename] = entry
+            for filename, atime in self.__accessed.items():
+                current = data.get(filename)
+                if current is not None and current[2] < atime:
+                    data[filename] = current[:2] + (atime,) + current[3:]
+
+            removed = set()
+            if sweep_due(self.__filename):
+                # files used in this run are already checked
+                checked = self.__changed | self.__accessed.keys()
+                removed = find_missing(fn for fn in data if fn not in checked)
+            removed |= self.__limits.evicted(
+                ((fn, entry[2], entry[3]) for fn, entry in data.items()), time.time()
+            )
+            for filename in removed:
+                del data[filename]
+            if removed:
+                logging.info("Removed %i json cache entries", len(removed))
+
+            tmpfile = self.__filename + ".tmp"
+            with open(tmpfile, "wb") as f:
+                pickle.dump(data, f)
+            os.replace(tmpfile, self.__filename)
+        self.__data = data
+        self.__changed = set()
+        self.__removed = set()
+        self.__accessed = {}
+
+
+class SqliteStorage:
+    """
+    SQLite database in WAL mode, entries are loaded on demand
+    and each change is committed immediately by a small transaction,
+    so several processes can read and write the same cache concurrently
+    Existing pickle cache with the same file name is migrated automatically
+    """
+
+    SHARED = False
+
+    def __init__(self, filename, limits=None):
+        self.__filename = filename
+        self.__limits = limits if limits is not None else CacheLimits()
+        self.__db = None
+        self.__lock = threading.Lock()
+        self.__changed = set()
+        self.__accessed = {}
+
+    def __open(self):
+        if self.__db is not None:
             return
+        with file_lock(self.__filename):
+            migrate = None
+            if self.__is_pickle():
+                migrate = self.__filename + ".pickle.bak"
+                logging.info("Migrate json cache from pickle: %s", self.__filename)
+                os.replace(self.__filename, migrate)
+
+            self.__db = sqlite3.connect(
+                self.__filename, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False
+            )
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("PRAGMA synchronous=NORMAL")
+            self.__db.execute("""CREATE TABLE IF NOT EXISTS jsoncache (
+                    filename TEXT PRIMARY KEY,
+                    mtime REAL,
+                    data TEXT,
+                    atime REAL,
+                    size INTEGER
+                )""")
+            columns = {row[1] for row in self.__db.execute("PRAGMA table_info(jsoncache)")}
+            if "atime" not in columns:
+                # created by the previous version
+                self.__db.execute("ALTER TABLE jsoncache ADD COLUMN atime REAL")
+                self.__db.execute("ALTER TABLE jsoncache ADD COLUMN size INTEGER")
+                self.__db.execute("UPDATE jsoncache SET atime=?, size=length(data)", (time.time(),))
+            self.__db.commit()
+
+            if migrate is not None:
+                with open(migrate, "rb") as f:
+                    data = pickle.load(f)
+                now = time.time()
+                rows = []
+                for fn, entry in data.items():
+                    text = json.dumps(entry[1], ensure_ascii=False)
+                    rows.append((fn, entry[0], text, now, len(text)))
+                self.__db.executemany(SQLITE_UPSERT, rows)
+                self.__db.commit()
+                logging.info("Migrated %i entries, old cache saved to: %s", len(data), migrate)
+
+    def __is_pickle(self):
+        if not os.path.exists(self.__filename):
+            return False
         with open(self.__filename, "rb") as f:
-            self.__data = pickle.load(f)
+            header = f.read(len(SQLITE_HEADER))
+        return header not in (SQLITE_HEADER, b"")
+
+    def get(self, filename):
+        with self.__lock:
+            self.__open()
+            row = self.__db.execute(
+                "SELECT mtime, data, atime FROM jsoncache WHERE filename=?", (filename,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[2] > ATIME_RESOLUTION:
+                self.__accessed[filename] = now
+        return row[0], json.loads(row[1])
+
+    def set(self, filename, mtime, cont, size):
+        with self.__lock:
+            self.__open()
+            self.__db.execute(
+                SQLITE_UPSERT,
+                (filename, mtime, json.dumps(cont, ensure_ascii=False), time.time(), size),
+            )
+            self.__db.commit()
+            self.__changed.add(filename)
+
+    def remove(self, filename):
+        with self.__lock:
+            self.__open()
+            row = self.__db.execute(
+                "SELECT 1 FROM jsoncache WHERE filename=?", (filename,)
+            ).fetchone()
+            if row is None:
+                return
+            self.__db.execute("DELETE FROM jsoncache WHERE filename=?", (filename,))
+            self.__db.commit()
+            self.__changed.add(filename)
+
+    def flush(self):
+        with self.__lock:
+            if self.__db is None:
+                return
+            self.__db.executemany(
+                "UPDATE jsoncache SET atime=? WHERE filename=? AND atime<?",
+                ((atime, fn, atime) for fn, atime in self.__accessed.items()),
+            )
+            if self.__changed:
+                # sweep only after the runs which changed something, like pickle storage does
+                rows = self.__db.execute("SELECT filename, atime, size FROM jsoncache").fetchall()
+                removed = set()
+                if sweep_due(self.__filename):
+                    checked = self.__changed | self.__accessed.keys()
+                    removed = find_missing(row[0] for row in rows if row[0] not in checked)
+                removed |= self.__limits.evicted(rows, time.time())
+                self.__db.executemany(
+                    "DELETE FROM jsoncache WHERE filename=?", ((fn,) for fn in removed)
+                )
+                if removed:
+                    logging.info("Removed %i json cache entries", len(removed))
+            self.__db.commit()
+            self.__changed = set()
+            self.__accessed = {}
+
+
+BACKENDS = {
+    "pickle": PickleStorage,
+    "sqlite": SqliteStorage,
+}
 
-    def __save(self):
-        if self.__filename is None or not self.__changed:
-            return
-        tmpfile = self.__filename + ".tmp"
-        with open(tmpfile, "wb") as f:
-            pickle.dump(self.__data, f)
-        os.replace(tmpfile, self.__filename)
+
+class JsonCache:
+    """
+    Cache of JSON files content, validated by file mtime
+    Backend is selected by MMDIARY_CACHE_BACKEND (pickle - default, sqlite)
+    Entries of removed files are dropped on save, once per MMDIARY_CACHE_SWEEP_INTERVAL (days),
+    cache size can be bounded by
+    MMDIARY_CACHE_MAX_ENTRIES, MMDIARY_CACHE_MAX_SIZE (MB), MMDIARY_CACHE_MAX_AGE (days)
+    """
+
+    def __init__(self):
+        filename = os.getenv("MMDIARY_CACHE")
+        if filename is not None:
+            backend = os.getenv("MMDIARY_CACHE_BACKEND", "pickle")
+            if backend not in BACKENDS:
+                raise UserWarning(f"Incorrect cache backend: {backend}")
+            self.__storage = BACKENDS[backend](os.path.expanduser(filename), limits_from_env())
+        else:
+            self.__storage = PickleStorage(None)
+        self.__pending = None
+        atexit.register(self.flush)
+
+    def flush(self):
+        """
+        Saves cache changes (done automatically at exit)
+        """
+        self.__storage.flush()
 
     def __load_json(self, filename):
         with open(filename, "r", encoding="utf-8") as f:
@@ -41,29 +493,96 @@ class JsonCache:
         with open(filename, "w", encoding="utf-8") as f:
             json.dump(cont, f, ensure_ascii=False, indent=2)
 
-    def get(self, filename):
-        self.__load()
+    def __result(self, cont, readonly):
+        if readonly:
+            return freeze(cont)
+        if self.__storage.SHARED:
+            return copy.deepcopy(cont)
+        return cont
+
+    def get(self, filename, file_stat=None, readonly=False):
+        """
+        file_stat - stat result of the file, if already known (e.g. from directory scan)
+        readonly - return read-only view without copying (see freeze/thaw),
+            otherwise the result is a private copy which can be modified
+        """
+        if self.__pending and filename in self.__pending:
+            cont = self.__pending[filename][1]
+            return freeze(cont) if readonly else copy.deepcopy(cont)
         try:
-            file_stat = os.stat(filename)
-            try:
-                time, cont = self.__data[filename]
-                if file_stat.st_mtime == time:
-                    return copy.deepcopy(cont)
-            except KeyError:
-                pass
+            if file_stat is None:
+                file_stat = os.stat(filename)
+            entry = self.__storage.get(filename)
+            if entry is not None:
+                mtime, cont = entry
+                if file_stat.st_mtime == mtime:
+                    return self.__result(cont, readonly)
             cont = self.__load_json(filename)
-            self.__data[filename] = (file_stat.st_mtime, cont)
-            self.__changed = True
-            return copy.deepcopy(cont)
+            self.__storage.set(filename, file_stat.st_mtime, cont, file_stat.st_size)
+            return self.__result(cont, readonly)
         except FileNotFoundError:
-            if filename in self.__data:
-                del self.__data[filename]
-                self.__changed = True
+            self.__storage.remove(filename)
             raise
 
     def set(self, cont, filename):
-        self.__load()
+        """
+        Returns stat result of the saved file (None inside transaction)
+        """
+        if self.__pending is not None:
+            tmpfile = filename + ".tmp"
+            self.__save_json(cont, tmpfile)
+            self.__pending[filename] = (tmpfile, cont)
+            return None
         self.__save_json(cont, filename)
         file_stat = os.stat(filename)
-        self.__data[filename] = (file_stat.st_mtime, cont)
-        self.__changed = True
+        self.__storage.set(filename, file_stat.st_mtime, cont, file_stat.st_size)
+        return file_stat
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group writes: files set inside the transaction are written to temporary files,
+        which are synced by single barrier and renamed all together on successful exit,
+        nothing is changed on exception
+        Yields list, which is filled by (filename, file_stat, cont) of the saved files on commit
+        Nested transactions are joined to the outer one (and theirs lists stay empty)
+        """
+        if self.__pending is not None:
+            yield []
+            return
+        saved = []
+        self.__pending = {}
+        try:
+            yield saved
+        except BaseException:
+            pending, self.__pending = self.__pending, None
+            remove_files(tmpfile for tmpfile, _ in pending.values())
+            raise
+        pending, self.__pending = self.__pending, None
+        saved.extend(self.__commit(pending))
+
+    def __commit(self, pending):
+        try:
+            for tmpfile, _ in pending.values():
+                fsync(tmpfile)
+        except OSError:
+            remove_files(tmpfile for tmpfile, _ in pending.values())
+            raise
+
+        res = []
+        dirs = set()
+        items = list(pending.items())
+        for i, (filename, (tmpfile, cont)) in enumerate(items):
+            try:
+                os.replace(tmpfile, filename)
+            except OSError:
+                remove_files(tmpfile for _, (tmpfile, _) in items[i:])
+                raise
+            dirs.add(os.path.dirname(os.path.abspath(filename)))
+            file_stat = os.stat(filename)
+            self.__storage.set(filename, file_stat.st_mtime, cont, file_stat.st_size)
+            res.append((filename, file_stat, cont))
+        for dirname in dirs:
+            fsync(dirname)
+        logging.debug("Transaction committed: %i files", len(res))
+        return res
@@ -0,0 +1,136 @@
+import logging
+import os
+import re
+
+from mmdiary.utils import ignorerules
+
+NO_SCAN_MARKER = ".mmdiaryskip"
+
+ROOT_OPTIONS_SEPARATOR = ","
+# only trailing parts like this are options, so the path itself can contain commas
+ROOT_OPTION_RE = re.compile(r"^\s*\w+=")
+
+
+def parse_root(root):
+    """
+    Split library root definition to path and options dict
+    Options are the trailing comma separated name=value parts, everything before them
+    is the path (it can contain commas, unless a part after the comma looks like an option)
+    """
+    parts = root.split(ROOT_OPTIONS_SEPARATOR)
+    count = 1
+    while count < len(parts) and not all(ROOT_OPTION_RE.match(p) for p in parts[count:]):
+        count += 1
+    path = ROOT_OPTIONS_SEPARATOR.join(parts[:count])
+    opts = parts[count:]
+    options = {}
+    for opt in opts:
+        name, _, value = opt.partition("=")
+        name = name.strip()
+        if name == "maxdepth":
+            options["maxdepth"] = int(value)
+        elif name == "symlinks":
+            options["symlinks"] = value.strip().lower() in ("1", "yes", "true", "follow")
+        elif name == "exclude":
+            options.setdefault("exclude", []).append(value)
+        else:
+            raise UserWarning(f"Incorrect root option: {opt} in {root}")
+    return path, options
+
+
+def library_root(spec):
+    """
+    Returns (path, maxdepth, symlinks, rules) of the library root definition (see MediaLib),
+    rules - ignore rules chain (see ignorerules.is_ignored) of the exclude options
+    """
+    path, options = parse_root(spec) if spec else (None, {})
+    if not path or not os.path.isdir(os.path.expanduser(path)):
+        raise UserWarning(f"Incorrect path: {spec}")
+    rules = ()
+    if options.get("exclude"):
+        rules = (("", ignorerules.IgnoreRules(options["exclude"])),)
+    return (
+        os.path.expanduser(path),
+        options.get("maxdepth"),
+        options.get("symlinks", False),
+        rules,
+    )
+
+
+def root_item(root):
+    """
+    Returns walk item (path, relative path, depth left, follow symlinks, ignore rules)
+    of the library root definition (with options, see MediaLib)
+    """
+    path, max_depth, follow_symlinks, rules = library_root(root)
+    return (os.path.abspath(path), "", max_depth, follow_symlinks, rules)
+
+
+def subdir_item(item, name):
+    """
+    Returns walk item of the subdirectory or None if it's ignored or too deep
+    """
+    path, rel, depth_left, follow_symlinks, rules = item
+    if depth_left is not None:
+        if depth_left <= 0:
+            return None
+        depth_left -= 1
+    drel = os.path.join(rel, name)
+    if ignorerules.is_ignored(rules, drel, True):
+        return None
+    return (os.path.join(path, name), drel, depth_left, follow_symlinks, rules)
+
+
+def is_ignored_file(item, name):
+    return ignorerules.is_ignored(item[4], os.path.join(item[1], name), False)
+
+
+def list_walk_dir(item, visited):
+    """
+    Returns entries of the directory and its walk item with .mmdiaryignore rules added,
+    None if the directory is skipped
+    """
+    path, rel, depth_left, follow_symlinks, rules = item
+    try:
+        if follow_symlinks:
+            st = os.stat(path)
+            if (st.st_dev, st.st_ino) in visited:
+                logging.warning("symlink loop: %s", path)
+                return None
+            visited.add((st.st_dev, st.st_ino))
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError as err:
+        logging.error("scan files error: %s", err)
+        return None
+    names = {entry.name for entry in entries}
+    if NO_SCAN_MARKER in names:
+        return None
+    if ignorerules.IGNORE_FILE in names:
+        rules = rules + ((rel, ignorerules.load(os.path.join(path, ignorerules.IGNORE_FILE))),)
+    return (path, rel, depth_left, follow_symlinks, rules), entries
+
+
+def walk_dirs(item):
+    """
+    Walks the tree the same way as MediaLib scanner: subtrees with NO_SCAN_MARKER,
+    ignored by .mmdiaryignore or root options and deeper than maxdepth are skipped
+    Yields (walk item, files) for each directory, item rules include its .mmdiaryignore
+    """
+    visited = set()
+    tovisit = [item]
+    while tovisit:
+        listing = list_walk_dir(tovisit.pop(), visited)
+        if listing is None:
+            continue
+        item, entries = listing
+        files = []
+        for entry in entries:
+            if entry.is_dir():
+                if item[3] or not entry.is_symlink():
+                    sub = subdir_item(item, entry.name)
+                    if sub is not None:
+                        tovisit.append(sub)
+            elif not is_ignored_file(item, entry.name):
+                files.append(entry.path)
+        yield item, files
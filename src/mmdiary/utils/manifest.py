@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+
+from mmdiary.utils import jsoncache, libwalk, log
+
+DESCRIPTION = """
+Convert json sidecars of the library directories between separate files
+and per-directory manifests
+Possible actions:
+    to_manifest - Move all json files of each directory to its manifest
+    to_files - Extract all manifests entries to separate json files
+"""
+
+MANIFEST_FILE = ".mmdiary.jsonl"
+JSON_EXT = ".json"
+
+# manifest is compacted on append if it has more outdated lines than this ratio
+COMPACT_RATIO = 2
+COMPACT_MIN_LINES = 32
+
+
+@contextlib.contextmanager
+def dir_lock(dirname):
+    """
+    Inter-process exclusive lock of the directory manifest
+    (directory itself is locked, to not create lock files in the library)
+    """
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def read_manifest(path):
+    """
+    Returns (entries, lines count) of the manifest file
+    """
+    entries = {}
+    lines = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            lines += 1
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # incomplete line from the interrupted append
+                logging.warning("Broken manifest line %i in %s", lines, path)
+                continue
+            if rec.get("data") is None:
+                entries.pop(rec["name"], None)
+            else:
+                entries[rec["name"]] = rec["data"]
+    return entries, lines
+
+
+def write_manifest(path, entries):
+    tmpfile = path + ".tmp"
+    with open(tmpfile, "w", encoding="utf-8") as f:
+        for name in sorted(entries):
+            f.write(format_line(name, entries[name]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpfile, path)
+
+
+def format_line(name, cont):
+    return json.dumps({"name": name, "data": cont}, ensure_ascii=False) + "\n"
+
+
+class ManifestStore:
+    """
+    Json sidecars of the directory in one append-only JSON Lines manifest file,
+    each line is {"name": json file name, "data": content}, later lines override
+    earlier ones and null data removes the entry
+    Entries are addressed by the usual sidecar file names (dir/name.json)
+    """
+
+    def __init__(self):
+        self.__manifests = {}
+        self.__pending = None
+        self.__lock = threading.Lock()
+
+    def __manifest(self, dirname):
+        """
+        Returns (key, entries, lines) of the directory manifest, reloaded if changed
+        """
+        path = os.path.join(dirname, MANIFEST_FILE)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.__manifests.pop(dirname, None)
+            return None, {}, 0
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self.__manifests.get(dirname)
+        if cached is not None and cached[0] == key:
+            return cached
+        entries, lines = read_manifest(path)
+        res = (key, entries, lines)
+        self.__manifests[dirname] = res
+        return res
+
+    def __entries(self, dirname):
+        entries = self.__manifest(dirname)[1]
+        if self.__pending and dirname in self.__pending:
+            entries = dict(entries)
+            for name, cont in self.__pending[dirname].items():
+                if cont is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = cont
+        return entries
+
+    def names(self, dirname):
+        with self.__lock:
+            return list(self.__entries(dirname))
+
+    def get(self, jsonname):
+        """
+        Returns content of the entry (shared, must not be modified) or None
+        """
+        dirname, name = os.path.split(jsonname)
+        with self.__lock:
+            return self.__entries(dirname).get(name)
+
+    def contains(self, jsonname):
+        return self.get(jsonname) is not None
+
+    def mtime(self, jsonname):
+        """
+        Returns mtime of the manifest with the entry or None if there is no such entry
+        """
+        dirname, name = os.path.split(jsonname)
+        with self.__lock:
+            if name not in self.__entries(dirname):
+                return None
+        try:
+            return os.stat(os.path.join(dirname, MANIFEST_FILE)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def set(self, cont, jsonname):
+        """
+        Returns mtime of the manifest (None inside transaction)
+        """
+        dirname, name = os.path.split(jsonname)
+        with self.__lock:
+            if self.__pending is not None:
+                self.__pending.setdefault(dirname, {})[name] = cont
+                return None
+            return self.__append(dirname, {name: cont})
+
+    def remove(self, jsonname):
+        self.set(None, jsonname)
+
+    def __append(self, dirname, changes):
+        path = os.path.join(dirname, MANIFEST_FILE)
+        with dir_lock(dirname):
+            _, entries, lines = self.__manifest(dirname)
+            entries = dict(entries)
+            for name, cont in changes.items():
+                if cont is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = cont
+            lines += len(changes)
+            if lines > COMPACT_MIN_LINES and lines > len(entries) * COMPACT_RATIO:
+                write_manifest(path, entries)
+                lines = len(entries)
+            else:
+                with open(path, "a", encoding="utf-8") as f:
+                    for name, cont in changes.items():
+                        f.write(format_line(name, cont))
+                    f.flush()
+                    os.fsync(f.fileno())
+            st = os.stat(path)
+            self.__manifests[dirname] = ((st.st_mtime_ns, st.st_size), entries, lines)
+            return st.st_mtime
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Changes inside the transaction are kept in memory and appended to the manifests
+        on successful exit (see JsonCache.transaction)
+        Yields list, which is filled by (jsonname, mtime, cont) of the saved entries on commit
+        """
+        if self.__pending is not None:
+            yield []
+            return
+        saved = []
+        self.__pending = {}
+        try:
+            yield saved
+        finally:
+            with self.__lock:
+                pending, self.__pending = self.__pending, None
+        with self.__lock:
+            for dirname, changes in pending.items():
+                mtime = self.__append(dirname, changes)
+                for name, cont in changes.items():
+                    if cont is not None:
+                        saved.append((os.path.join(dirname, name), mtime, cont))
+
+
+def __to_manifest(dirname, filenames):
+    jsons = [fname for fname in filenames if os.path.splitext(fname)[1].lower() == JSON_EXT]
+    if not jsons:
+        return 0
+    path = os.path.join(dirname, MANIFEST_FILE)
+    with dir_lock(dirname):
+        entries = read_manifest(path)[0] if os.path.exists(path) else {}
+        for fname in jsons:
+            with open(os.path.join(dirname, fname), "r", encoding="utf-8") as f:
+                entries[fname] = json.load(f)
+        write_manifest(path, entries)
+        jsoncache.fsync(dirname)
+        jsoncache.remove_files(os.path.join(dirname, fname) for fname in jsons)
+    return len(jsons)
+
+
+def __to_files(dirname, filenames):
+    if MANIFEST_FILE not in filenames:
+        return 0
+    path = os.path.join(dirname, MANIFEST_FILE)
+    with dir_lock(dirname):
+        entries = read_manifest(path)[0]
+        for name, cont in entries.items():
+            filename = os.path.join(dirname, name)
+            if os.path.exists(filename):
+                # separate file has priority
+                continue
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(cont, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+        jsoncache.fsync(dirname)
+        os.unlink(path)
+    return len(entries)
+
+
+def convert(root, to_manifest):
+    """
+    Convert all directories of the library root (definition with options, see MediaLib),
+    skipped and ignored directories and files are not converted
+    Returns number of converted sidecars
+    """
+    count = 0
+    for item, files in libwalk.walk_dirs(libwalk.root_item(root)):
+        dirname = item[0]
+        filenames = [os.path.basename(f) for f in files]
+        if to_manifest:
+            converted = __to_manifest(dirname, filenames)
+        else:
+            converted = __to_files(dirname, filenames)
+        if converted:
+            logging.info("%s: %i sidecars converted", dirname, converted)
+        count += converted
+    return count
+
+
+def __args_parse():
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "-a", "--action", help="Action", required=True, choices=["to_manifest", "to_files"]
+    )
+    parser.add_argument(
+        "inpath",
+        nargs="+",
+        help="Library root dir(s): path[,option=value...], options: maxdepth, symlinks, exclude",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = __args_parse()
+    log.init_logger()
+    count = 0
+    for path in args.inpath:
+        count += convert(path, args.action == "to_manifest")
+    print("Total:", count)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,58 @@
 #!/usr/bin/python3
+# pylint: disable=too-many-instance-attributes
 
+import concurrent.futures
+import collections
+import contextlib
+import heapq
 import logging
 import os
+import threading
 
-from photo_importer import config as pi_config
 from photo_importer import fileprop
 
-from mmdiary.utils import jsoncache
+from mmdiary.utils import catalog, ignorerules, jsoncache, manifest, propcache, scanindex
+from mmdiary.utils.libwalk import NO_SCAN_MARKER, library_root
 
 TIME_OUT_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 JSON_EXT = ".json"
 MP4_EXT = ".mp4"
 
-NO_SCAN_MARKER = ".mmdiaryskip"
+SCAN_INDEX_VERSION = 4
 
-g_fileprop = fileprop.FileProp(pi_config.Config())
+SCAN_THREADS = int(os.getenv("MMDIARY_SCAN_THREADS", "8"))
+
+PREFETCH_THREADS = int(os.getenv("MMDIARY_PREFETCH_THREADS", "16"))
+
+# new sidecars storage: "files" - separate json files, "manifest" - per-directory manifest
+SIDECAR_MODE = os.getenv("MMDIARY_SIDECAR_MODE", "files")
+if SIDECAR_MODE not in ("files", "manifest"):
+    raise UserWarning(f"Incorrect sidecar mode: {SIDECAR_MODE}")
+# files queued for prefetch per thread
+PREFETCH_QUEUE = 4
+
+# large fields, which are not kept in memory by metadata only MediaFile
+LAZY_FIELDS = frozenset(("text", "caption", "videos"))
+
+g_fileprop = propcache.PropCache()
 g_cache = jsoncache.JsonCache()
+g_scanindex = scanindex.ScanIndex()
+g_catalog = catalog.Catalog()
+g_manifests = manifest.ManifestStore()
 
 
 class MediaFile:
-    def __init__(self, filename, jsonname=None):
+    def __init__(
+        self, filename, jsonname=None, *, scanned=False, json_stat=None, metadata_only=False
+    ):
+        """
+        scanned - filename/jsonname come from the library scan,
+            so existence is already known and needn't be checked
+        json_stat - json file stat result from the scan (if available)
+        metadata_only - keep in memory only metadata fields,
+            large fields (LAZY_FIELDS) are loaded on demand
+        """
         if filename is None and jsonname is None:
             raise UserWarning("filename and jsonname is None")
 
@@ -32,11 +64,21 @@ class MediaFile:
         if self.__jsonname is None:
             self.__jsonname = os.path.splitext(filename)[0] + JSON_EXT
 
-        self.__have_file = self.__filename is not None and os.path.exists(self.__filename)
-        self.__have_json = self.__jsonname is not None and os.path.exists(self.__jsonname)
+        if scanned:
+            self.__have_file = filename is not None
+            self.__have_json = jsonname is not None
+        else:
+            self.__have_file = self.__filename is not None and os.path.exists(self.__filename)
+            self.__have_json = os.path.exists(self.__jsonname) or g_manifests.contains(
+                self.__jsonname
+            )
+        self.__json_stat = json_stat
+        self.__metadata_only = metadata_only
 
         self.__prop = None
         self.__json = None
+        self.__lazy_fields = frozenset()
+        self.__info = None
 
     def name(self):
         return self.__filename
@@ -50,22 +92,107 @@ class MediaFile:
     def have_file(self):
         return self.__have_file
 
-    def load_json(self):
+    def load_json(self, readonly=False):
+        """
+        Returns modifiable copy of json content or read-only view if readonly specified
+        """
         if not self.have_json():
             return None
 
-        return g_cache.get(self.json_name())
+        json_stat = self.__json_stat
+        self.__json_stat = None
+        if json_stat is None:
+            # manifest entries are not looked up in the files cache, they have no json file
+            cont = g_manifests.get(self.json_name())
+            if cont is not None and not os.path.exists(self.json_name()):
+                return jsoncache.freeze(cont) if readonly else jsoncache.thaw(cont)
+        return g_cache.get(self.json_name(), json_stat, readonly)
+
+    def __in_manifest(self):
+        """
+        Separate json file has priority, new sidecars are stored according to SIDECAR_MODE
+        """
+        if os.path.exists(self.json_name()):
+            return False
+        return SIDECAR_MODE == "manifest" or g_manifests.contains(self.json_name())
+
+    def __json_mtime(self):
+        try:
+            return os.stat(self.json_name()).st_mtime
+        except FileNotFoundError:
+            mtime = g_manifests.mtime(self.json_name())
+            if mtime is None:
+                raise
+            return mtime
 
     def save_json(self, cont):
-        g_cache.set(cont, self.json_name())
-        self.__json = cont
+        if self.__in_manifest():
+            mtime = g_manifests.set(cont, self.json_name())
+        else:
+            file_stat = g_cache.set(cont, self.json_name())
+            mtime = file_stat.st_mtime if file_stat is not None else None
+        if mtime is not None:
+            self.__info = g_catalog.set(self.json_name(), mtime, cont)
+        else:
+            # inside transaction, the catalog is updated on commit
+            self.__info = catalog.extract(cont)
+        self.__set_json(jsoncache.freeze(cont))
+        self.__json_stat = None
         self.__have_json = True
 
+    def __set_json(self, cont):
+        if cont is not None and self.__metadata_only:
+            self.__lazy_fields = LAZY_FIELDS.intersection(cont)
+            cont = jsoncache.freeze({k: cont[k] for k in cont if k not in LAZY_FIELDS})
+        self.__json = cont
+
     def json(self):
+        """
+        Returns read-only view of json content, use load_json for modifiable copy
+        """
+        if self.__metadata_only:
+            return self.load_json(readonly=True)
+        return self.metadata()
+
+    def metadata(self):
+        """
+        Returns read-only view of json content without LAZY_FIELDS for metadata only file
+        (and the whole content otherwise)
+        """
         if self.__json is None:
-            self.__json = self.load_json()
+            self.__set_json(self.load_json(readonly=True))
         return self.__json
 
+    def info(self):
+        """
+        Returns dict of the catalog columns (see catalog.COLUMNS),
+        json is not loaded if the catalog is up to date
+        """
+        if self.__info is None and self.have_json():
+            if self.__json_stat is not None:
+                mtime = self.__json_stat.st_mtime
+            else:
+                mtime = self.__json_mtime()
+            self.__info = g_catalog.get(self.json_name(), mtime)
+            if self.__info is None:
+                self.__info = g_catalog.set(self.json_name(), mtime, self.metadata())
+        return self.__info
+
+    def __required_info(self):
+        """
+        Returns info(), FileNotFoundError is raised if the file has no json
+        """
+        info = self.info()
+        if info is None:
+            raise FileNotFoundError(f"No json for: {self}")
+        return info
+
+    def __info_field(self, name):
+        value = self.__required_info()[name]
+        if value is None:
+            raise KeyError(name)
+        return value
+
     def prop(self):
         if self.__prop is None:
             self.__prop = g_fileprop.get(self.name())
@@ -81,77 +208,219 @@ class MediaFile:
         return self.__filename if self.__filename is not None else self.__jsonname
 
     def type(self):
-        return self.json()["type"]
+        return self.__info_field("type")
 
     def recordtime(self):
-        return self.json()["recordtime"]
+        return self.__info_field("recordtime")
 
     def recorddate(self):
-        return get_date_from_timestring(self.recordtime())
+        return self.__info_field("recorddate")
 
     def state(self):
-        return self.json().get("state")
+        return self.__required_info()["state"]
 
     def get_field(self, filedname):
-        return self.json()[filedname]
+        if filedname in catalog.FIELDS:
+            return self.__info_field(filedname)
+        metadata = self.metadata()
+        if filedname in self.__lazy_fields:
+            return self.json()[filedname]
+        return metadata[filedname]
 
     def have_field(self, filedname):
-        return filedname in self.json()
+        if filedname in catalog.FIELDS:
+            return self.have_json() and self.info()[filedname] is not None
+        return filedname in self.metadata() or filedname in self.__lazy_fields
 
     def update_fields(self, fields):
+        cont = {}
         if self.have_json():
-            self.json().update(fields)
-        else:
-            self.__json = fields
-        self.save_json({k: v for k, v in self.__json.items() if v is not None})
+            cont.update(self.json())
+        cont.update(fields)
+        self.save_json(jsoncache.thaw({k: v for k, v in cont.items() if v is not None}))
 
     def remove_json(self):
         if not self.__have_json:
             return
-        os.unlink(self.json_name())
+        if os.path.exists(self.json_name()):
+            os.unlink(self.json_name())
+        else:
+            g_manifests.remove(self.json_name())
+        g_catalog.remove(self.json_name())
         self.__json = None
+        self.__info = None
+        self.__lazy_fields = frozenset()
         self.__have_json = False
 
 
 class MediaLib:
-    def __init__(self, root):
-        if not root or not os.path.isdir(os.path.expanduser(root)):
-            raise UserWarning(f"Incorrect path: {root}")
-        self.__root = os.path.expanduser(root)
+    """
+    Media library scanner
+    Root can be specified with options: path[,option=value...]
+        maxdepth=N - don't descend deeper than N levels below the root
+        symlinks=1 - follow symlinks to directories
+        exclude=PATTERN - gitignore-style exclude pattern (can be repeated)
+    Additionally .mmdiaryignore files with gitignore-style patterns are applied to theirs subtrees
+    and .mmdiaryskip marker excludes whole subtree
+    Several roots can be passed as a list, they are scanned concurrently
+    and merged to the same library
+    metadata_only - files are created metadata only (see MediaFile)
+    """
+
+    def __init__(self, root, metadata_only=False):
+        self.__metadata_only = metadata_only
+        self.__roots = []
+        for spec in [root] if isinstance(root, str) or root is None else root:
+            self.__roots.append(library_root(spec))
+        if len(self.__roots) == 0:
+            raise UserWarning("No library roots")
 
         self.__supported_exts = []
         for ext, tp in g_fileprop.ext_to_type.items():
             if tp in (fileprop.AUDIO, fileprop.VIDEO):
                 self.__supported_exts.append(ext)
+        g_scanindex.validate((SCAN_INDEX_VERSION, sorted(self.__supported_exts)))
+        self.__visited_lock = threading.Lock()
 
     def __on_walk_error(self, err):
         logging.error('scan files error: %s', err)
 
-    def __scan_files(self, inpath):
-        res_files = {}
-        json_files = {}
-        for root, _, files in os.walk(inpath, onerror=self.__on_walk_error):
-            if NO_SCAN_MARKER in files:
-                continue
-            for fname in files:
-                base, ext = os.path.splitext(fname)
-                lext = ext.lower()
-                full_name = os.path.join(root, fname)
+    def __list_dir(self, path):
+        """
+        Returns listing for the scan index and stats of json files, gathered
+        during listing (DirEntry keeps them, so they are reused by JsonCache)
+        """
+        media = []
+        jsons = []
+        subdirs = []
+        links = []
+        has_ignore = False
+        has_manifest = False
+        stats = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if entry.is_symlink():
+                        links.append(entry.name)
+                    else:
+                        subdirs.append(entry.name)
+                    continue
+                if entry.name == NO_SCAN_MARKER:
+                    return ((), (), (), (), True, False, False), {}
+                if entry.name == ignorerules.IGNORE_FILE:
+                    has_ignore = True
+                    continue
+                if entry.name == manifest.MANIFEST_FILE:
+                    has_manifest = True
+                    continue
+                lext = os.path.splitext(entry.name)[1].lower()
                 if lext in self.__supported_exts:
-                    if base in res_files:
-                        logging.error('duplicate %s, %s', full_name, res_files[base])
-                    res_files[base] = full_name
+                    media.append(entry.name)
                 elif lext == JSON_EXT:
-                    json_files[base] = full_name
+                    jsons.append(entry.name)
+                    try:
+                        stats[entry.name] = entry.stat()
+                    except OSError:
+                        pass
+        return (media, jsons, subdirs, links, False, has_ignore, has_manifest), stats
+
+    def __scan_dir(self, path, follow_symlinks, visited):
+        """
+        Returns (media, jsons, subdirs, links, skip, has_ignore, has_manifest) for the directory,
+        from the scan index if the directory was not changed since the last listing,
+        and json files stats (only for listed directories, index doesn't keep them,
+        because files can be rewritten without the directory mtime change)
+        Sidecars from the directory manifest are added to jsons
+        (manifest is read each time, because it's updated without the directory mtime change)
+        """
+        st = os.stat(path)
+        if follow_symlinks:
+            with self.__visited_lock:
+                if (st.st_dev, st.st_ino) in visited:
+                    logging.warning('symlink loop: %s', path)
+                    return ((), (), (), (), True, False, False), {}
+                visited.add((st.st_dev, st.st_ino))
+        cont = g_scanindex.get(path, st.st_mtime_ns)
+        stats = {}
+        if cont is None:
+            cont, stats = self.__list_dir(path)
+            g_scanindex.set(
+                path, st.st_mtime_ns, cont, (os.path.join(path, name) for name in cont[0])
+            )
+        if cont[6]:
+            jsons = set(cont[1])
+            names = [name for name in g_manifests.names(path) if name not in jsons]
+            cont = (cont[0], list(cont[1]) + names) + cont[2:]
+        return cont, stats
+
+    def __filter_ignored(self, rules, rel, names):
+        if not rules:
+            return names
+        return [n for n in names if not ignorerules.is_ignored(rules, os.path.join(rel, n), False)]
+
+    def __queue_subdirs(self, item, rules, dirs, tovisit):
+        path, rel, depth_left, follow_symlinks, _ = item
+        if depth_left is not None:
+            if depth_left <= 0:
+                return
+            depth_left -= 1
+        for dname in reversed(dirs):
+            drel = os.path.join(rel, dname)
+            if not ignorerules.is_ignored(rules, drel, True):
+                tovisit.append(
+                    (os.path.join(path, dname), drel, depth_left, follow_symlinks, rules)
+                )
 
-        return res_files, json_files
+    def __process_dir(self, item, cont, tovisit):
+        """
+        Queue subdirectories and return media/json files which are not ignored
+        """
+        path, rel, _, follow_symlinks, rules = item
+        media, jsons, subdirs, links, skip, has_ignore, _ = cont
+        if skip:
+            return (), ()
+        if has_ignore:
+            rules = rules + ((rel, ignorerules.load(os.path.join(path, ignorerules.IGNORE_FILE))),)
+
+        self.__queue_subdirs(
+            item, rules, list(subdirs) + list(links) if follow_symlinks else subdirs, tovisit
+        )
+
+        return self.__filter_ignored(rules, rel, media), self.__filter_ignored(rules, rel, jsons)
+
+    def __iter_dirs(self):
+        """
+        Walk all roots, yields (path, media, jsons, stats) for each scanned directory
+        Directories are stat'ed/listed on the bounded thread pool (MMDIARY_SCAN_THREADS),
+        so independent roots and subtrees are scanned concurrently,
+        but results are yielded in the stable order (breadth-first, roots in the given order,
+        subdirectories sorted by name), so duplicates are resolved the same way on each scan
+        """
+        visited = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(SCAN_THREADS, 1)) as pool:
+
+            def submit(item):
+                return item, pool.submit(self.__scan_dir, item[0], item[3], visited)
+
+            pending = collections.deque(
+                submit((path, "", max_depth, follow_symlinks, rules))
+                for path, max_depth, follow_symlinks, rules in self.__roots
+            )
+            while pending:
+                item, future = pending.popleft()
+                try:
+                    cont, stats = future.result()
+                except OSError as err:
+                    self.__on_walk_error(err)
+                    continue
+                tovisit = []
+                media, jsons = self.__process_dir(item, cont, tovisit)
+                pending.extend(submit(sub) for sub in sorted(tovisit, key=lambda sub: sub[0]))
+                if media or jsons:
+                    yield item[0], media, jsons, stats
 
     def get_all(self):
-        files, json_files = self.__scan_files(self.__root)
-        return [
-            MediaFile(files.get(base, None), json_files.get(base, None))
-            for base in set(files.keys()) | set(json_files.keys())
-        ]
+        return list(self.__iter_files())
 
     def get_processed(self, should_have_file=True):
         return sorted(
@@ -166,6 +435,221 @@ class MediaLib:
     def get_new(self):
         return sorted(list(filter(lambda mf: not mf.have_json(), self.get_all())))
 
+    def __iter_files(self):
+        """
+        Yields files as directories are scanned, media and json are paired within the directory,
+        from the media files with the same name the first scanned one is used
+        """
+        bases = {}
+        for root, media, jsons, stats in self.__iter_dirs():
+            json_bases = {os.path.splitext(fname)[0]: fname for fname in jsons}
+            files = []
+            for fname in media:
+                base = os.path.splitext(fname)[0]
+                full_name = os.path.join(root, fname)
+                if base in bases:
+                    logging.error('duplicate %s, %s', full_name, bases[base])
+                    json_bases.pop(base, None)
+                    continue
+                bases[base] = full_name
+                jsonname = json_bases.pop(base, None)
+                files.append(
+                    MediaFile(
+                        full_name,
+                        None if jsonname is None else os.path.join(root, jsonname),
+                        scanned=True,
+                        json_stat=stats.get(jsonname),
+                        metadata_only=self.__metadata_only,
+                    )
+                )
+            for jsonname in json_bases.values():
+                files.append(
+                    MediaFile(
+                        None,
+                        os.path.join(root, jsonname),
+                        scanned=True,
+                        json_stat=stats.get(jsonname),
+                        metadata_only=self.__metadata_only,
+                    )
+                )
+            files.sort()
+            yield from files
+
+    def __iter_ordered(self, files, window):
+        """
+        Reorder files by name within bounded window
+        (the output is fully sorted if the window is bigger than the library)
+        """
+        if not window:
+            yield from files
+            return
+        heap = []
+        for mf in files:
+            if len(heap) < window:
+                heapq.heappush(heap, mf)
+            else:
+                yield heapq.heappushpop(heap, mf)
+        while heap:
+            yield heapq.heappop(heap)
+
+    def iter_all(self, window=None):
+        """
+        Streaming counterpart of get_all
+        Files are yielded as soon as theirs directory is scanned,
+        window - size of the ordering window (None - scan order)
+        """
+        return self.__iter_ordered(self.__iter_files(), window)
+
+    def iter_processed(self, should_have_file=True, window=None):
+        return self.__iter_ordered(
+            filter(
+                lambda mf: mf.have_json() and (not should_have_file or mf.have_file()),
+                self.__iter_files(),
+            ),
+            window,
+        )
+
+    def __indexed_media(self):
+        """
+        Returns set of the media files accepted by the library walk rules
+        (ignore files, exclude/maxdepth options, skip markers), taken from the scan index,
+        or None if the index is out of date for some library directory
+        (directories are only stat'ed, nothing is listed)
+        """
+        visited = set()
+        tovisit = [
+            (path, "", max_depth, follow_symlinks, rules)
+            for path, max_depth, follow_symlinks, rules in self.__roots
+        ]
+        res = set()
+        while tovisit:
+            item = tovisit.pop()
+            try:
+                st = os.stat(item[0])
+            except OSError:
+                return None
+            if item[3]:
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+            cont = g_scanindex.get(item[0], st.st_mtime_ns)
+            if cont is None:
+                return None
+            media, _ = self.__process_dir(item, cont, tovisit)
+            res.update(os.path.join(item[0], fname) for fname in media)
+        return res
+
+    def find(self, text):
+        """
+        Processed files, which full names contain the text, looked up by the scan index
+        without the library scanning
+        Returns None if the index is empty or out of date (some directory was changed
+        after the last scan), then the library must be scanned
+        """
+        accepted = self.__indexed_media()
+        if accepted is None:
+            return None
+        names = g_scanindex.find(text)
+        if names is None:
+            return None
+        res = []
+        for name in sorted(names & accepted):
+            mf = MediaFile(name, metadata_only=self.__metadata_only)
+            if not mf.have_file():
+                return None
+            if mf.have_json():
+                res.append(mf)
+        return res
+
+    def iter_new(self, window=None):
+        return self.__iter_ordered(
+            filter(lambda mf: not mf.have_json(), self.__iter_files()), window
+        )
+
+
+def __prefetch_file(mf):
+    try:
+        mf.info()
+    except Exception as ex:
+        # will be raised again on the consumer access
+        logging.debug("prefetch %s failed: %s", mf, ex)
+    return mf
+
+
+def prefetch(files, threads=None):
+    """
+    Load json sidecars of the files (to the catalog and JsonCache) on the bounded
+    thread pool (MMDIARY_PREFETCH_THREADS) ahead of the consumer,
+    so cold runs are not limited by per-file storage latency
+    Yields the same files in the same order, files is a list or an iterable
+    """
+    threads = max(threads if threads is not None else PREFETCH_THREADS, 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        queue = collections.deque()
+        for mf in files:
+            if mf.have_json():
+                queue.append(pool.submit(__prefetch_file, mf))
+            else:
+                queue.append(mf)
+            while len(queue) > threads * PREFETCH_QUEUE:
+                yield __prefetch_result(queue.popleft())
+        while queue:
+            yield __prefetch_result(queue.popleft())
+
+
+def prefetch_props(files, threads=None):
+    """
+    Resolve media properties of the files (see PropCache) on the bounded
+    thread pool (MMDIARY_PROP_THREADS) ahead of the consumer
+    Yields the same files in the same order, files is a list or an iterable
+    """
+    threads = max(threads if threads is not None else propcache.PROP_THREADS, 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        queue = collections.deque()
+        for mf in files:
+            queue.append((mf, pool.submit(mf.prop)))
+            while len(queue) > threads * PREFETCH_QUEUE:
+                yield __prop_result(queue.popleft())
+        while queue:
+            yield __prop_result(queue.popleft())
+
+
+def __prop_result(item):
+    mf, future = item
+    # on failure properties are resolved (and error raised) again by the consumer
+    future.exception()
+    return mf
+
+
+def __prefetch_result(item):
+    if isinstance(item, concurrent.futures.Future):
+        return item.result()
+    return item
+
+
+@contextlib.contextmanager
+def transaction():
+    """
+    Group json files writes (see JsonCache.transaction), on exception
+    nothing is written, but already updated MediaFile objects keep new content,
+    so they should be dropped
+    Manifests are appended last, only after the json files are committed
+    """
+    with g_manifests.transaction() as manifest_saved, g_cache.transaction() as saved:
+        yield
+    for filename, file_stat, cont in saved:
+        g_catalog.set(filename, file_stat.st_mtime, cont)
+    for jsonname, mtime, cont in manifest_saved:
+        g_catalog.set(jsonname, mtime, cont)
+
+
+def is_media_file(filename):
+    """
+    Check that file has supported audio/video extension
+    """
+    tp = g_fileprop.ext_to_type.get(os.path.splitext(filename)[1].lower())
+    return tp in (fileprop.AUDIO, fileprop.VIDEO)
+
 
 def split_large_text(text, max_block_size):
     block_len = 0
@@ -2,6 +2,19 @@ import progressbar
 
 
 def start(text, maxval):
+    if maxval is None:
+        return progressbar.ProgressBar(
+            maxval=progressbar.UnknownLength,
+            widgets=[
+                f"{text}: ",
+                progressbar.Counter(),
+                ' ',
+                progressbar.Timer(),
+                ' ',
+                progressbar.AnimatedMarker(),
+            ],
+        ).start()
+
     return progressbar.ProgressBar(
         maxval=maxval,
         widgets=[
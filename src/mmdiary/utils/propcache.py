@@ -0,0 +1,142 @@
+# pylint: disable=too-many-instance-attributes
+import os
+import atexit
+import concurrent.futures
+import pickle
+import threading
+
+from photo_importer import config as pi_config
+from photo_importer import fileprop
+
+from mmdiary.utils import jsoncache
+
+PROPCACHE_VERSION = 1
+
+PROP_THREADS = int(os.getenv("MMDIARY_PROP_THREADS", "4"))
+
+
+class PropCache:
+    """
+    Persistent cache of the photo_importer file properties (type and time),
+    entries are keyed by (path, size, mtime_ns), so restarted runs don't parse
+    media metadata again
+    Each thread uses its own FileProp (and exiftool process), so properties
+    can be resolved in parallel (see get_many)
+    Stored next to the json cache (MMDIARY_CACHE + ".props"), in memory only if cache not set
+    """
+
+    def __init__(self, conf=None):
+        """
+        conf - photo_importer config, default config is read on first use
+        """
+        self.__config = conf
+        self.__local = threading.local()
+        filename = os.getenv("MMDIARY_CACHE")
+        if filename is not None:
+            self.__filename = os.path.expanduser(filename) + ".props"
+        else:
+            self.__filename = None
+        self.__entries = None
+        self.__checked = set()
+        self.__updated = set()
+        self.__lock = threading.Lock()
+        atexit.register(self.save)
+
+    def __conf(self):
+        if self.__config is None:
+            self.__config = pi_config.Config()
+        return self.__config
+
+    def __signature(self):
+        # results depend on the config (time sources, time shift, etc.)
+        return (PROPCACHE_VERSION, tuple(sorted(self.__conf()["main"].items())))
+
+    def __fileprop(self):
+        fp = getattr(self.__local, "fileprop", None)
+        if fp is None:
+            fp = fileprop.FileProp(self.__conf())
+            self.__local.fileprop = fp
+        return fp
+
+    @property
+    def ext_to_type(self):
+        return self.__fileprop().ext_to_type
+
+    def __read(self):
+        if self.__filename is None or not os.path.exists(self.__filename):
+            return {}
+        try:
+            with open(self.__filename, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # cache is only an optimization, just rebuild it
+            return {}
+        if data.get("signature") != self.__signature():
+            return {}
+        return data["entries"]
+
+    def __load(self):
+        if self.__entries is None:
+            self.__entries = self.__read()
+
+    def save(self):
+        """
+        Saves the cache if changed (done automatically at exit)
+        Saving is done under the file lock and merged with the file content,
+        so entries saved by other processes in the meantime are kept
+        """
+        if self.__filename is None or not self.__updated:
+            return
+        with self.__lock, jsoncache.file_lock(self.__filename):
+            entries = self.__read()
+            for path in self.__updated:
+                entries[path] = self.__entries[path]
+            if jsoncache.sweep_due(self.__filename):
+                removed = jsoncache.find_missing(
+                    path for path in entries if path not in self.__checked
+                )
+                for path in removed:
+                    del entries[path]
+            tmpfile = self.__filename + ".tmp"
+            with open(tmpfile, "wb") as f:
+                pickle.dump({"signature": self.__signature(), "entries": entries}, f)
+            os.replace(tmpfile, self.__filename)
+            self.__entries = entries
+            self.__updated = set()
+
+    def get(self, filename):
+        """
+        Returns photo_importer FilePropRes of the file
+        """
+        try:
+            st = os.stat(filename)
+            key = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            key = None
+        fp = self.__fileprop()
+        if key is not None:
+            with self.__lock:
+                self.__load()
+                entry = self.__entries.get(filename)
+            if entry is not None and entry[0] == key:
+                self.__checked.add(filename)
+                path, name = os.path.split(filename)
+                ext = os.path.splitext(name)[1].lower()
+                return fileprop.FilePropRes(fp, *entry[1:3], path, ext, *entry[3:])
+
+        res = fp.get(filename)
+        if key is not None:
+            with self.__lock:
+                self.__entries[filename] = (key, res.type(), res.time(), res.out_name(), res.ok())
+                self.__checked.add(filename)
+                self.__updated.add(filename)
+        return res
+
+    def get_many(self, filenames, threads=None):
+        """
+        Returns list of FilePropRes of the files, resolved on the thread pool
+        (MMDIARY_PROP_THREADS)
+        """
+        threads = max(threads if threads is not None else PROP_THREADS, 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(self.get, filenames))
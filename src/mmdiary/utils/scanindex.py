@@ -0,0 +1,132 @@
+import os
+import atexit
+import pickle
+import threading
+import time
+
+from mmdiary.utils import jsoncache
+
+# directories modified less than this time ago are not stored,
+# because mtime resolution can hide changes made right after the listing
+RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+
+TRIGRAM_SIZE = 3
+
+
+def trigrams(text):
+    return {text[i : i + TRIGRAM_SIZE] for i in range(len(text) - TRIGRAM_SIZE + 1)}
+
+
+def empty_index(signature=None):
+    return {"signature": signature, "dirs": {}, "names": {}, "trigrams": {}}
+
+
+class ScanIndex:
+    """
+    Persistent directory index used by MediaLib scanner
+    Keeps for each directory its mtime and the list of media/sidecar entries,
+    so unchanged directories can be reused without listing
+    Also keeps trigram index of the media files names for fast lookup by name part
+    """
+
+    def __init__(self):
+        filename = os.getenv("MMDIARY_SCAN_INDEX")
+        if filename is not None:
+            self.__filename = os.path.expanduser(filename)
+        else:
+            self.__filename = None
+        self.__data = None
+        self.__changed = False
+        self.__lock = threading.Lock()
+        atexit.register(self.__save)
+
+    def __load(self):
+        if self.__data is not None:
+            return
+        self.__data = empty_index()
+        if self.__filename is None or not os.path.exists(self.__filename):
+            return
+        try:
+            with open(self.__filename, "rb") as f:
+                self.__data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # index is only an optimization, just rebuild it
+            self.__data = empty_index()
+
+    def __save(self):
+        if self.__filename is None or not self.__changed:
+            return
+        with self.__lock, jsoncache.file_lock(self.__filename):
+            tmpfile = self.__filename + ".tmp"
+            with open(tmpfile, "wb") as f:
+                pickle.dump(self.__data, f)
+            os.replace(tmpfile, self.__filename)
+            self.__changed = False
+
+    def validate(self, signature):
+        """
+        Drop all entries if they were collected with another signature
+        (e.g. list of supported extensions changed)
+        """
+        with self.__lock:
+            self.__load()
+            if self.__data["signature"] != signature:
+                self.__data = empty_index(signature)
+                self.__changed = True
+
+    def get(self, path, mtime_ns):
+        with self.__lock:
+            self.__load()
+            entry = self.__data["dirs"].get(path)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        return entry[1]
+
+    def set(self, path, mtime_ns, cont, names=()):
+        """
+        names - full names of the media files in the directory (for find)
+        """
+        if time.time_ns() - mtime_ns < RACY_INTERVAL_NS:
+            return
+        with self.__lock:
+            self.__load()
+            self.__data["dirs"][path] = (mtime_ns, cont)
+            self.__update_names(path, tuple(names))
+            self.__changed = True
+
+    def __update_names(self, path, names):
+        old_names = self.__data["names"].get(path, ())
+        if old_names == names:
+            return
+        index = self.__data["trigrams"]
+        for name in set(old_names) - set(names):
+            for trigram in trigrams(os.path.basename(name)):
+                index[trigram].discard(name)
+                if not index[trigram]:
+                    del index[trigram]
+        for name in set(names) - set(old_names):
+            for trigram in trigrams(os.path.basename(name)):
+                index.setdefault(trigram, set()).add(name)
+        if names:
+            self.__data["names"][path] = names
+        else:
+            self.__data["names"].pop(path, None)
+
+    def find(self, text):
+        """
+        Returns set of the indexed media files, which full names contain the text,
+        or None if the index is empty
+        Names are indexed by basename trigrams, so the last part of the text
+        (after path separator) is used for the lookup
+        """
+        with self.__lock:
+            self.__load()
+            if not self.__data["names"]:
+                return None
+            query = trigrams(text.rsplit(os.sep, 1)[-1])
+            if query:
+                index = self.__data["trigrams"]
+                candidates = min((index.get(trigram, set()) for trigram in query), key=len)
+            else:
+                candidates = (name for names in self.__data["names"].values() for name in names)
+            return {name for name in candidates if text in name}
@@ -0,0 +1,244 @@
+import os
+import ctypes
+import ctypes.util
+import logging
+import select
+import struct
+import time
+
+from mmdiary.utils import libwalk
+
+# seconds without changes after which the file is considered completely written
+WATCH_DELAY = float(os.getenv("MMDIARY_WATCH_DELAY", "60"))
+
+# tree rescan interval of the polling watcher (if inotify is not available)
+POLL_INTERVAL = float(os.getenv("MMDIARY_WATCH_POLL_INTERVAL", "300"))
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct("iIII")
+
+READ_SIZE = 64 * 1024
+
+
+def walk_files(root):
+    """
+    Returns all not ignored files of the library root (see libwalk.walk_dirs)
+    """
+    res = []
+    for _, files in libwalk.walk_dirs(libwalk.root_item(root)):
+        res += files
+    return res
+
+
+class InotifyWatcher:
+    """
+    Reports changed files of the trees by Linux inotify (via libc, no extra dependencies),
+    watches are added to all directories, including created later
+    roots - library root definitions, with options (see MediaLib)
+    """
+
+    def __init__(self, roots):
+        self.__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.__roots = roots
+        # watch descriptor: walk item of the directory
+        self.__dirs = {}
+        for root in roots:
+            self.__add_tree(libwalk.root_item(root))
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def __add_tree(self, item):
+        """
+        Adds watches to the tree (walk item, see libwalk.walk_dirs), returns files which
+        already exist in it (e.g. directory was moved into the library or created with files)
+        """
+        res = []
+        for diritem, files in libwalk.walk_dirs(item):
+            wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(diritem[0]), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                logging.warning("Can't watch %s: %s", diritem[0], os.strerror(err))
+                continue
+            self.__dirs[wd] = diritem
+            res += files
+        return res
+
+    def read(self, timeout):
+        """
+        Waits for changes up to timeout seconds, returns set of changed files
+        """
+        if not select.select([self.__fd], [], [], timeout)[0]:
+            return set()
+        try:
+            data = os.read(self.__fd, READ_SIZE)
+        except BlockingIOError:
+            return set()
+        res = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, size = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos : pos + size].rstrip(b"\0"))
+            pos += size
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("Watch queue overflow, rescan all")
+                for root in self.__roots:
+                    res.update(walk_files(root))
+                continue
+            if mask & IN_IGNORED:
+                self.__dirs.pop(wd, None)
+                continue
+            item = self.__dirs.get(wd)
+            if item is None or not name:
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    sub = libwalk.subdir_item(item, name)
+                    if sub is not None:
+                        res.update(self.__add_tree(sub))
+            elif not libwalk.is_ignored_file(item, name):
+                res.add(os.path.join(item[0], name))
+        return res
+
+
+class PollingWatcher:
+    """
+    Fallback watcher for systems without inotify, rescans the trees
+    each POLL_INTERVAL seconds and reports new and changed files
+    """
+
+    def __init__(self, roots, interval=None):
+        self.__roots = roots
+        self.__interval = interval if interval is not None else POLL_INTERVAL
+        self.__files = self.__scan()
+        self.__next_scan = time.monotonic() + self.__interval
+
+    def close(self):
+        pass
+
+    def __scan(self):
+        res = {}
+        for root in self.__roots:
+            for filename in walk_files(root):
+                try:
+                    st = os.stat(filename)
+                except FileNotFoundError:
+                    continue
+                res[filename] = (st.st_size, st.st_mtime_ns)
+        return res
+
+    def read(self, timeout):
+        wait = self.__next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        self.__next_scan = time.monotonic() + self.__interval
+        files = self.__scan()
+        res = {path for path, key in files.items() if self.__files.get(path) != key}
+        self.__files = files
+        return res
+
+
+def create_watcher(roots):
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError) as ex:
+        # AttributeError: libc without inotify (not Linux)
+        logging.warning("inotify is not available (%s), use polling", ex)
+        return PollingWatcher(roots)
+
+
+class Debouncer:
+    """
+    Collects changed files until they stay unchanged (by events and by size/mtime)
+    for the delay, so files which are still being written (copied, synced) are
+    not processed
+    """
+
+    def __init__(self, delay=None):
+        self.__delay = delay if delay is not None else WATCH_DELAY
+        self.__pending = {}
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def add(self, path, now=None):
+        now = time.monotonic() if now is None else now
+        self.__pending[path] = (now + self.__delay, None)
+
+    def timeout(self, now=None):
+        """
+        Returns seconds until the next pending file check (None if nothing pending)
+        """
+        if not self.__pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(min(deadline for deadline, _ in self.__pending.values()) - now, 0)
+
+    def ready(self, now=None):
+        """
+        Returns list of completely written files, they are removed from pending
+        """
+        now = time.monotonic() if now is None else now
+        res = []
+        for path, (deadline, key) in list(self.__pending.items()):
+            if deadline > now:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.__pending[path]
+                continue
+            newkey = (st.st_size, st.st_mtime_ns)
+            if key == newkey:
+                del self.__pending[path]
+                res.append(path)
+            else:
+                self.__pending[path] = (now + self.__delay, newkey)
+        return sorted(res)
+
+
+def watch(roots, callback, delay=None, watcher=None):
+    """
+    Calls callback with list of new/changed files of the trees, when they are
+    completely written (see Debouncer), runs until interrupted
+    roots - library root definitions, with options (see MediaLib)
+    """
+    if watcher is None:
+        watcher = create_watcher(roots)
+    debouncer = Debouncer(delay)
+    logging.info("Watching: %s", roots)
+    try:
+        while True:
+            timeout = debouncer.timeout()
+            for path in watcher.read(POLL_INTERVAL if timeout is None else timeout):
+                debouncer.add(path)
+            files = debouncer.ready()
+            if files:
+                try:
+                    callback(files)
+                except Exception:
+                    logging.exception("Changed files processing failed")
+    finally:
+        watcher.close()
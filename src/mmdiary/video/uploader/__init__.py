@@ -1,13 +1,16 @@
-from . import youtube
-from . import dailymotion
+import importlib
 
 from .common import *
 
+# provider modules are imported on demand, they pull heavy API clients
+PROVIDER_MODULES = {
+    "youtube": "mmdiary.video.uploader.youtube",
+    "dailymotion": "mmdiary.video.uploader.dailymotion",
+}
+
 
 def generate_video_url(provider, pos=None):
     name = provider["name"]
-    if name == youtube.PROVIDER_NAME:
-        return youtube.generate_video_url(provider, pos)
-    if name == dailymotion.PROVIDER_NAME:
-        return dailymotion.generate_video_url(provider, pos)
-    raise UserWarning(f"Unknown provider: {name}")
+    if name not in PROVIDER_MODULES:
+        raise UserWarning(f"Unknown provider: {name}")
+    return importlib.import_module(PROVIDER_MODULES[name]).generate_video_url(provider, pos)
@@ -30,6 +30,9 @@ YOUTUBE_URL = "https://www.youtube.com/watch?v="
 
 PROVIDER_NAME = "youtube"
 
+# dates verified per state updates transaction
+VERIFY_BATCH_SIZE = 20
+
 
 def generate_video_url(provider, pos=None):
     url = YOUTUBE_URL + provider["video_id"]
@@ -343,31 +346,36 @@ class VideoUploader:
         else:
             toprocess = sorted(self.__lib.get_converted(masks) + self.__lib.get_uploaded(masks))
         res = {"count": len(toprocess), "err": 0, "no_url": 0, "exists": 0, "not_exists": 0}
-        for date in toprocess:
-            try:
-                mf = self.__lib.results()[date]
-                data = mf.json()
-                if not self.__check_provider(data, no_exception=True):
-                    res["no_url"] += 1
-                    continue
-                video_id = data["provider"]["video_id"]
-                is_exists = self.check_video_exists(video_id)
-                if is_exists:
-                    res["exists"] += 1
-                else:
-                    res["not_exists"] += 1
-                logging.info("Video %s is exists: %s", date, is_exists)
-                if self.__upload_verification:
-                    if is_exists:
-                        self.__lib.set_converted(date, {"provider": None, "upload": True})
-                    else:
-                        self.__lib.disable_date(date, "verify_urls")
-
-            except Exception:
-                res["err"] += 1
-                logging.exception("Video verification failed")
+        # state updates are committed by batches, so a failure doesn't lose the done ones
+        for start in range(0, len(toprocess), VERIFY_BATCH_SIZE):
+            with self.__lib.transaction():
+                for date in toprocess[start : start + VERIFY_BATCH_SIZE]:
+                    try:
+                        self.__verify_url(date, res)
+                    except Exception:
+                        res["err"] += 1
+                        logging.exception("Video verification failed")
         return res
 
+    def __verify_url(self, date, res):
+        mf = self.__lib.results()[date]
+        data = mf.json()
+        if not self.__check_provider(data, no_exception=True):
+            res["no_url"] += 1
+            return
+        video_id = data["provider"]["video_id"]
+        is_exists = self.check_video_exists(video_id)
+        if is_exists:
+            res["exists"] += 1
+        else:
+            res["not_exists"] += 1
+        logging.info("Video %s is exists: %s", date, is_exists)
+        if self.__upload_verification:
+            if is_exists:
+                self.__lib.set_converted(date, {"provider": None, "upload": True})
+            else:
+                self.__lib.disable_date(date, "verify_urls")
+
 
 def __args_parse():
     parser = argparse.ArgumentParser(
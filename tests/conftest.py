@@ -0,0 +1,73 @@
+# pylint: disable=too-few-public-methods
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from photo_importer import fileprop
+
+from mmdiary.transcriber import client as service_client
+from mmdiary.transcriber import service
+from mmdiary.utils import medialib
+
+
+class FakeProp:
+    """
+    Audio file properties, time is taken from the file name
+    """
+
+    def __init__(self, filename):
+        self.__time = datetime.strptime(os.path.basename(filename)[:19], "%Y-%m-%d_%H-%M-%S")
+
+    def type(self):
+        return fileprop.AUDIO
+
+    def time(self):
+        return self.__time
+
+
+@pytest.fixture
+def fake_prop(monkeypatch):
+    monkeypatch.setattr(medialib.MediaFile, "prop", lambda self: FakeProp(self.name()))
+
+
+class FakeTranscriber:
+    """
+    Saves content (text only by default) to json of each file, files with "fail"
+    in the name are not transcribed
+    """
+
+    def __init__(self):
+        self.processed = []
+        self.content = {"text": "text"}
+
+    def process_list(self, fileslist):
+        for mf in fileslist:
+            self.processed.append(mf.name())
+            if "fail" not in mf.name():
+                mf.save_json(dict(self.content))
+
+
+@pytest.fixture
+def transcriber_service(tmp_path, monkeypatch):
+    """
+    Returns function, which starts the transcriber service with FakeTranscriber
+    on the test socket (MMDIARY_TRANSCRIBE_SOCKET) and returns the transcriber
+    """
+    path = str(tmp_path / "transcriber.sock")
+    monkeypatch.setenv("MMDIARY_TRANSCRIBE_SOCKET", path)
+
+    def start():
+        tr = FakeTranscriber()
+        thread = threading.Thread(target=service.TranscriberService(tr).serve, args=(path,))
+        thread.daemon = True
+        thread.start()
+        for _ in range(100):
+            if service_client.connect() is not None:
+                return tr
+            time.sleep(0.05)
+        raise AssertionError("Transcriber service is not started")
+
+    return start
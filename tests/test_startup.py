@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+import pytest
+
+# heavy dependencies, which must be imported only by the commands which use them
+HEAVY_MODULES = (
+    "whisper",
+    "torch",
+    "googleapiclient",
+    "dailymotion",
+    "notion",
+    "notion_client",
+    "telegram",
+    "mixvideoconcat",
+)
+
+UPLOADER_BACKENDS = (
+    "mmdiary.video.uploader.youtube",
+    "mmdiary.video.uploader.dailymotion",
+)
+
+
+@pytest.mark.parametrize(
+    "module, lazy",
+    [
+        (
+            "mmdiary",
+            (
+                "mmdiary.utils.datelib",
+                "mmdiary.transcriber.transcriber",
+                "mmdiary.video.uploader",
+                "numpy",
+            ),
+        ),
+        ("mmdiary.utils.datelib", UPLOADER_BACKENDS + ("numpy",)),
+        ("mmdiary.utils.medialib", UPLOADER_BACKENDS + ("numpy",)),
+        ("mmdiary.video.uploader", UPLOADER_BACKENDS + ("numpy",)),
+        ("mmdiary.transcriber.transcriber", UPLOADER_BACKENDS),
+    ],
+)
+def test_startup(module, lazy):
+    code = f"import sys\nimport {module}\nprint(' '.join(sorted(sys.modules)))\n"
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    loaded = set(out.split())
+    assert module in loaded
+    assert [name for name in HEAVY_MODULES + lazy if name in loaded] == []
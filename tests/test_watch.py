@@ -0,0 +1,41 @@
+import argparse
+
+import mmdiary
+from mmdiary.transcriber import client as service_client
+from mmdiary.utils import medialib
+
+process_changed = getattr(mmdiary, "__process_changed")
+
+
+def test_watch_with_service(tmp_path, monkeypatch, transcriber_service):
+    """
+    json is saved by the transcriber service, the watcher must see it
+    """
+    tr = transcriber_service()
+    tr.content = {"type": "video", "recordtime": "2024-01-01 10:00:00", "text": "t"}
+
+    processed = []
+    uploaded = []
+    monkeypatch.setattr(mmdiary, "__run_video_processor", processed.append)
+    monkeypatch.setattr(mmdiary, "__upload_to_notion", uploaded.extend)
+
+    audio_root = tmp_path / "audio"
+    video_root = tmp_path / "video"
+    audio_root.mkdir()
+    video_root.mkdir()
+    audio = audio_root / "2024-01-01_10-00-00.mp3"
+    video = video_root / "2024-01-01_10-00-00.mp4"
+    audio.write_bytes(b"a")
+    video.write_bytes(b"v")
+
+    watch_state = {"audio": [str(audio_root)], "video": [str(video_root)]}
+    args = argparse.Namespace(notion=True, youtube=False, dailymotion=False)
+    process_changed(args, [str(audio)], watch_state)
+    args.notion = False
+    process_changed(args, [str(video)], watch_state)
+
+    assert tr.processed == [str(audio), str(video)]
+    assert [mf.name() for mf in uploaded] == [str(audio)]
+    assert processed == [["2024-01-01"]]
+    assert isinstance(watch_state["transcriber"], service_client.TranscriberClient)
+    assert medialib.MediaFile(str(video)).recorddate() == "2024-01-01"
@@ -0,0 +1,43 @@
+# pylint: disable=too-few-public-methods
+
+import sys
+import types
+
+import pytest
+
+from mmdiary.transcriber import backends
+
+
+def test_whisper_backend(monkeypatch):
+    class Model:
+        def transcribe(self, _audio, language):
+            return {
+                "text": " a b",
+                "segments": [
+                    {"id": 0, "start": 0, "end": 1.5, "text": " a", "tokens": [1]},
+                    {"id": 1, "start": 1.5, "end": 3, "text": " b", "tokens": [2]},
+                ],
+                "language": language,
+            }
+
+    fake = types.ModuleType("whisper")
+    fake.load_model = lambda model: Model()
+    monkeypatch.setitem(sys.modules, "whisper", fake)
+
+    res = backends.create_backend("whisper", "tiny").transcribe("a.mp3", "ru")
+    assert res == {
+        "text": " a b",
+        "segments": [
+            {"start": 0.0, "end": 1.5, "text": " a"},
+            {"start": 1.5, "end": 3.0, "text": " b"},
+        ],
+        "language": "ru",
+    }
+
+
+def test_create_backend(monkeypatch):
+    with pytest.raises(UserWarning):
+        backends.create_backend("unknown", "tiny")
+    monkeypatch.setitem(sys.modules, "faster_whisper", None)
+    with pytest.raises(UserWarning):
+        backends.create_backend("faster-whisper", "tiny")
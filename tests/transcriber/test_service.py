@@ -0,0 +1,26 @@
+from mmdiary.transcriber import client as service_client
+from mmdiary.utils import medialib
+
+
+def test_service(tmp_path, transcriber_service):
+    assert service_client.connect() is None
+    tr = transcriber_service()
+    client = service_client.connect()
+
+    names = []
+    for name in ("2024-01-01_10-00-00.mp3", "2024-01-02_10-00-00_fail.mp3"):
+        (tmp_path / name).write_bytes(b"")
+        names.append(str(tmp_path / name))
+    files = [medialib.MediaFile(name) for name in names]
+    assert client.process_list(files) == [names[1]]
+    assert medialib.MediaFile(names[0]).have_json()
+
+    # already transcribed by the other client: skipped
+    tr.processed.clear()
+    assert client.process_list(files) == [names[1]]
+    assert tr.processed == [names[1]]
+
+    # transcribed again on request
+    tr.processed.clear()
+    client.process_list([medialib.MediaFile(names[0])])
+    assert tr.processed == [names[0]]
@@ -0,0 +1,99 @@
+# pylint: disable=too-few-public-methods
+
+import concurrent.futures
+import os
+
+import numpy as np
+import pytest
+
+from mmdiary.transcriber import transcriber
+from mmdiary.utils import medialib
+
+
+def make_files(tmp_path, sizes):
+    res = []
+    for i, size in enumerate(sizes):
+        name = tmp_path / f"2024-01-0{i + 1}_10-00-00.mp3"
+        name.write_bytes(b"x" * size)
+        res.append(medialib.MediaFile(str(name)))
+    return res
+
+
+def test_longest_first(tmp_path, monkeypatch):
+    files = make_files(tmp_path, [1, 3, 2])
+    durations = {files[0].name(): 30.0, files[1].name(): 10.0, files[2].name(): 20.0}
+    monkeypatch.setattr(transcriber, "media_duration", durations.get)
+    assert transcriber.longest_first(files) == [files[0], files[2], files[1]]
+
+    # by size if any duration is unknown
+    del durations[files[2].name()]
+    assert transcriber.longest_first(files) == [files[1], files[2], files[0]]
+
+
+class FakeModel:
+    def __init__(self):
+        self.transcribed = []
+
+    def transcribe(self, samples, _language):
+        self.transcribed.append(samples[0])
+        return {"segments": [{"start": 0.0, "end": 1.0, "text": f"text {samples[0]}"}]}
+
+
+@pytest.mark.usefixtures("fake_prop")
+def test_pipeline(tmp_path, monkeypatch):
+    files = make_files(tmp_path, [1, 1, 1])
+    model = FakeModel()
+    decoded = []
+
+    def decode_audio(filename):
+        if filename == files[1].name():
+            raise UserWarning("Audio decoding failed")
+        decoded.append(filename)
+        return np.full(16000, len(decoded), dtype=np.float32)
+
+    monkeypatch.setattr(transcriber.backends, "create_backend", lambda *args: model)
+    monkeypatch.setattr(transcriber.audio, "decode_audio", decode_audio)
+    monkeypatch.setattr(transcriber, "TRANSCRIBE_VAD", False)
+
+    transcriber.Transcriber("tiny", "en").process_list(files)
+
+    assert model.transcribed == [1, 2]
+    assert files[0].load_json()["text"] == "text 1.0"
+    assert not files[1].have_json()
+    assert files[2].load_json()["text"] == "text 2.0"
+
+
+class FakeFileModel:
+    def transcribe(self, filename, _language):
+        return {"segments": [{"start": 0.0, "end": 1.0, "text": os.path.basename(filename)}]}
+
+
+def init_fake_worker(_backend, _model, language, _threads):
+    # runs in the spawned worker process, so monkeypatch of the test is not applied there
+    transcriber.g_worker["model"] = FakeFileModel()
+    transcriber.g_worker["language"] = language
+
+
+@pytest.mark.usefixtures("fake_prop")
+def test_pool(tmp_path, monkeypatch):
+    files = make_files(tmp_path, [1, 1, 1])
+    durations = {files[0].name(): 10.0, files[1].name(): 30.0, files[2].name(): 20.0}
+    submitted = []
+
+    class RecordingPool(concurrent.futures.ProcessPoolExecutor):
+        def submit(self, fn, /, *args, **kwargs):
+            submitted.append(args[0])
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(transcriber, "media_duration", durations.get)
+    monkeypatch.setattr(transcriber, "init_worker", init_fake_worker)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", RecordingPool)
+
+    transcriber.Transcriber("tiny", "en", workers=2).process_list(files)
+
+    assert submitted == [files[1].name(), files[2].name(), files[0].name()]
+    for mf in files:
+        cont = mf.load_json()
+        assert cont["text"] == os.path.basename(mf.name())
+        assert cont["model"] == "whisper/tiny"
+        assert cont["duration"] == 1.0
@@ -0,0 +1,94 @@
+# pylint: disable=too-few-public-methods
+
+import numpy as np
+
+from mmdiary.transcriber import transcriber, vad
+from mmdiary.transcriber.audio import SAMPLE_RATE
+
+
+def make_audio(parts, noise=0.001):
+    """
+    parts - list of (seconds, is speech)
+    noise - background noise level
+    """
+    rng = np.random.default_rng(0)
+    res = []
+    for seconds, speech in parts:
+        count = int(seconds * SAMPLE_RATE)
+        samples = noise * rng.standard_normal(count)
+        if speech:
+            t = np.arange(count) / SAMPLE_RATE
+            samples += 0.3 * np.sin(2 * np.pi * 220 * t)
+        res.append(samples)
+    return np.concatenate(res).astype(np.float32)
+
+
+class FakeModel:
+    def __init__(self, segments=()):
+        self.segments = list(segments)
+        self.length = None
+
+    def transcribe(self, audio, language):
+        self.length = len(audio) / SAMPLE_RATE
+        return {
+            "text": "".join(s["text"] for s in self.segments),
+            "segments": [dict(s) for s in self.segments],
+            "language": language,
+        }
+
+
+def test_speech_regions():
+    samples = make_audio([(10, False), (3, True), (0.5, False), (2, True), (20, False), (4, True)])
+    regions = [
+        (start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in vad.speech_regions(samples)
+    ]
+    assert len(regions) == 2
+    # short pause is kept inside the region, padding is added
+    assert abs(regions[0][0] - (10 - vad.PADDING)) < 0.05
+    assert abs(regions[0][1] - (15.5 + vad.PADDING)) < 0.05
+    assert abs(regions[1][0] - (35.5 - vad.PADDING)) < 0.05
+    assert abs(regions[1][1] - 39.5) < 0.05
+
+    assert not vad.speech_regions(np.zeros(SAMPLE_RATE * 5, dtype=np.float32))
+
+
+def test_speech_regions_noise():
+    # speech over the steady noise of the same and double level:
+    # not separable, so the whole audio is kept
+    for noise in (0.3, 0.6):
+        samples = make_audio([(10, False), (20, True), (10, False), (20, True)], noise)
+        assert vad.speech_regions(samples) == [(0, len(samples))]
+
+
+def test_transcribe_audio():
+    samples = make_audio([(30, False), (2, True), (30, False), (2, True), (30, False)])
+
+    model = FakeModel(
+        [
+            {"start": 0.5, "end": 2.0, "text": " a"},
+            # second region starts after the first one (2 + 2 * padding) and the gap
+            {"start": 2.6 + vad.GAP + 0.3, "end": 2.6 + vad.GAP + 2.3, "text": " b"},
+        ]
+    )
+    res = transcriber.transcribe_audio(model, samples, "ru")
+    assert model.length < 10
+    assert [(round(s["start"], 1), round(s["end"], 1)) for s in res["segments"]] == [
+        (30.2, 31.7),
+        (62.0, 64.0),
+    ]
+
+
+def test_transcribe_audio_whole():
+    model = FakeModel([{"start": 1.0, "end": 2.0, "text": " a"}])
+
+    # no speech found: the whole audio is transcribed, not an empty result
+    samples = np.zeros(SAMPLE_RATE * 5, dtype=np.float32)
+    res = transcriber.transcribe_audio(model, samples, "ru")
+    assert model.length == 5
+    assert res["text"] == " a"
+
+    # low SNR
+    samples = make_audio([(10, False), (20, True), (10, False)], 0.3)
+    res = transcriber.transcribe_audio(model, samples, "ru")
+    assert model.length == 40
+    assert res["segments"][0]["start"] == 1.0
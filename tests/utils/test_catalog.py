@@ -0,0 +1,70 @@
+from mmdiary.utils import catalog, medialib
+
+
+def test_catalog(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_CACHE", str(tmp_path / "cache"))
+    jsonname = str(tmp_path / "a.json")
+    (tmp_path / "a.json").write_text("{}")
+    cont = {
+        "type": "mergedvideo",
+        "recordtime": "2024-01-01",
+        "state": "uploaded",
+        "provider": {"name": "youtube", "account": "acc"},
+        "duration": 12,
+    }
+
+    cat = catalog.Catalog()
+    info = cat.set(jsonname, 1.0, cont)
+    assert info["recorddate"] == "2024-01-01"
+    assert info["account"] == "acc"
+    assert info["duration"] == 12.0
+    assert info["upload"] is True
+    assert info["source"] is None
+    cat.save()
+
+    cat = catalog.Catalog()
+    assert cat.get(jsonname, 1.0) == info
+    assert cat.get(jsonname, 2.0) is None
+    cat.remove(jsonname)
+    assert cat.get(jsonname, 1.0) is None
+
+
+def test_merge(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_CACHE", str(tmp_path / "cache"))
+    names = {}
+    for name in ("a", "b", "c"):
+        names[name] = str(tmp_path / f"{name}.json")
+        (tmp_path / f"{name}.json").write_text("{}")
+    cat = catalog.Catalog()
+    cat.set(names["c"], 1.0, {"state": "old"})
+    cat.save()
+
+    # two processes update the catalog concurrently
+    first = catalog.Catalog()
+    second = catalog.Catalog()
+    first.set(names["a"], 1.0, {"state": "a"})
+    first.remove(names["c"])
+    second.set(names["b"], 1.0, {"state": "b"})
+    second.set(names["c"], 2.0, {"state": "new"})
+    second.save()
+    first.save()
+
+    cat = catalog.Catalog()
+    assert cat.get(names["a"], 1.0)["state"] == "a"
+    assert cat.get(names["b"], 1.0)["state"] == "b"
+    assert cat.get(names["c"], 2.0) is None
+
+
+def test_mediafile_info(tmp_path, monkeypatch):
+    mf = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"))
+    mf.save_json({"recordtime": "2024-01-01 10:00:00", "type": "audio", "text": "text"})
+
+    def no_load(*args, **kwargs):
+        raise AssertionError("json loaded")
+
+    monkeypatch.setattr(medialib.g_cache, "get", no_load)
+    mf = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"))
+    assert mf.recorddate() == "2024-01-01"
+    assert mf.type() == "audio"
+    assert mf.state() is None
+    assert not mf.have_field("source")
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from mmdiary.utils import datelib
+
+
+def test_date_index():
+    index = datelib.DateIndex(["2024-03-02", "2024-02-01", "2024-03-01", "2023-03-01"])
+    index.add("2024-03-10")
+    index.remove("2024-02-01")
+    assert list(index) == ["2023-03-01", "2024-03-01", "2024-03-02", "2024-03-10"]
+    assert index.match(["2024-03-*"]) == ["2024-03-01", "2024-03-02", "2024-03-10"]
+    assert index.match(["2024-03-0?", "*-03-01"]) == ["2023-03-01", "2024-03-01", "2024-03-02"]
+    assert index.match(["2024-03-01"]) == ["2024-03-01"]
+    assert index.match("2023-*") == ["2023-03-01"]
+    assert index.match(None) == list(index)
+    assert index.range("2024-01-01", "2024-03-02") == ["2024-03-01", "2024-03-02"]
+
+
+def write_json(path, cont):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cont, f)
+
+
+def test_states(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    res = tmp_path / "res"
+    src.mkdir()
+    res.mkdir()
+    for date in ("2024-01-01", "2024-01-02", "2024-02-01"):
+        (src / f"{date}_10-00-00.mp4").write_bytes(b"")
+        write_json(src / f"{date}_10-00-00.json", {"recordtime": f"{date} 10:00:00"})
+    write_json(res / "2024-01-02.json", {"recordtime": "2024-01-02", "state": "converted"})
+    monkeypatch.setenv("MMDIARY_VIDEO_LIB_ROOTS", str(src))
+    monkeypatch.setenv("MMDIARY_VIDEO_RES_DIR", str(res))
+
+    lib = datelib.DateLib()
+    assert lib.get_nonprocessed() == ["2024-01-01", "2024-02-01"]
+    assert lib.get_nonprocessed(["2024-01-*"]) == ["2024-01-01"]
+    assert lib.get_converted() == ["2024-01-02"]
+
+    lib.set_in_progress("2024-01-01")
+    lib.set_uploaded("2024-01-02", {"name": "youtube", "account": "acc"})
+    assert lib.get_nonprocessed() == ["2024-02-01"]
+    assert lib.get_converted() == []
+    assert lib.get_uploaded(["2024-*"]) == ["2024-01-02"]
+    assert lib.list_dates("uploaded", None, "other") == []
+    assert lib.list_dates(None, ["2024-01-*"]) == [
+        ("2024-01-01", "inprocess"),
+        ("2024-01-02", "uploaded"),
+    ]
+
+    lib.set_not_processed("2024-01-01")
+    assert lib.get_nonprocessed() == ["2024-01-01", "2024-02-01"]
+    assert datelib.DateLib().get_uploaded() == ["2024-01-02"]
+
+    lib = datelib.DateLib()
+    lib.disable_video("01-02_10")
+    assert lib.get_nonprocessed() == ["2024-01-01", "2024-01-02", "2024-02-01"]
+    assert lib.list_disabled_videos() == [str(src / "2024-01-02_10-00-00.mp4")]
+
+    # matched to many, including the file added after the last scan
+    (src / "2024-01-01_10-30-00.mp4").write_bytes(b"")
+    write_json(src / "2024-01-01_10-30-00.json", {"recordtime": "2024-01-01 10:30:00"})
+    lib = datelib.DateLib()
+    lib.disable_video("01-01_10")
+    assert lib.list_disabled_videos() == [str(src / "2024-01-02_10-00-00.mp4")]
+
+
+def test_transaction(tmp_path, monkeypatch):
+    res = tmp_path / "res"
+    res.mkdir()
+    for date in ("2024-01-01", "2024-01-02", "2024-02-01"):
+        write_json(res / f"{date}.json", {"recordtime": date, "state": "uploaded"})
+    monkeypatch.setenv("MMDIARY_VIDEO_LIB_ROOTS", str(tmp_path))
+    monkeypatch.setenv("MMDIARY_VIDEO_RES_DIR", str(res))
+
+    lib = datelib.DateLib()
+    assert lib.set_reupload(["2024-01-*"]) == 2
+    assert lib.get_converted() == ["2024-01-01", "2024-01-02"]
+
+    with pytest.raises(RuntimeError):
+        with lib.transaction():
+            lib.set_state("2024-02-01", "none")
+            assert lib.get_uploaded() == []
+            raise RuntimeError()
+    assert lib.get_uploaded() == ["2024-02-01"]
+
+    assert lib.set_states("2024-*", "converted") == 3
+    assert datelib.DateLib().get_converted() == ["2024-01-01", "2024-01-02", "2024-02-01"]
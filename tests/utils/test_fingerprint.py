@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from mmdiary.transcriber import transcriber
+from mmdiary.utils import fingerprint, medialib
+
+
+def test_fingerprint(tmp_path):
+    small = tmp_path / "small.mp3"
+    small.write_bytes(b"abc")
+    large = tmp_path / "large.mp3"
+    large.write_bytes(os.urandom(fingerprint.SAMPLE_SIZE * 4))
+    assert fingerprint.fingerprint(str(small)).startswith("3:")
+    copy = tmp_path / "copy.mp3"
+    copy.write_bytes(large.read_bytes())
+    assert fingerprint.fingerprint(str(copy)) == fingerprint.fingerprint(str(large))
+    assert fingerprint.fingerprint(str(small)) != fingerprint.fingerprint(str(large))
+
+
+def test_merge(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_FINGERPRINT_INDEX", str(tmp_path / "index"))
+    for name in ("a", "b"):
+        (tmp_path / f"{name}.mp3").write_bytes(name.encode())
+    first = fingerprint.FingerprintIndex()
+    second = fingerprint.FingerprintIndex()
+    first.add(str(tmp_path / "a.mp3"), str(tmp_path / "a.json"))
+    second.add(str(tmp_path / "b.mp3"), str(tmp_path / "b.json"))
+    first.save()
+    second.save()
+
+    index = fingerprint.FingerprintIndex()
+    for name in ("a", "b"):
+        assert index.find(str(tmp_path / f"{name}.mp3")) == (
+            str(tmp_path / f"{name}.mp3"),
+            str(tmp_path / f"{name}.json"),
+        )
+
+
+@pytest.mark.usefixtures("fake_prop")
+def test_reuse(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_FINGERPRINT_INDEX", str(tmp_path / "index"))
+    monkeypatch.setattr(transcriber, "g_fingerprints", fingerprint.FingerprintIndex())
+    lib_dir = tmp_path / "lib"
+    lib_dir.mkdir()
+    old = lib_dir / "2024-01-01_10-00-00.mp3"
+    old.write_bytes(b"content")
+    medialib.MediaFile(str(old)).save_json({"source": old.name, "text": "hello"})
+    (lib_dir / "2024-01-02_10-00-00.mp3").write_bytes(b"other")
+    # new file found: processed files are registered
+    lib = medialib.MediaLib(str(lib_dir))
+    left = list(transcriber.skip_reused(lib.iter_new(), lib))
+    assert [os.path.basename(mf.name()) for mf in left] == ["2024-01-02_10-00-00.mp3"]
+
+    os.rename(old, lib_dir / "2024-01-01_10-00-01.mp3")
+
+    lib = medialib.MediaLib(str(lib_dir))
+    left = list(transcriber.skip_reused(lib.iter_new(), lib))
+    assert [os.path.basename(mf.name()) for mf in left] == ["2024-01-02_10-00-00.mp3"]
+    moved = medialib.MediaFile(str(lib_dir / "2024-01-01_10-00-01.mp3"))
+    cont = moved.load_json()
+    assert cont["text"] == "hello"
+    assert cont["source"] == "2024-01-01_10-00-01.mp3"
+    assert cont["recordtime"] == "2024-01-01 10:00:01"
+    assert cont["type"] == "audio"
+    assert moved.recorddate() == "2024-01-01"
+    # moved: the original media file doesn't exist
+    assert not (lib_dir / "2024-01-01_10-00-00.json").exists()
+
+
+def test_register_lazily(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_FINGERPRINT_INDEX", str(tmp_path / "index"))
+    monkeypatch.setattr(transcriber, "g_fingerprints", fingerprint.FingerprintIndex())
+    registered = []
+    monkeypatch.setattr(transcriber, "register_transcripts", registered.append)
+    lib_dir = tmp_path / "lib"
+    lib_dir.mkdir()
+    lib = medialib.MediaLib(str(lib_dir))
+
+    # nothing new: the library is not read
+    assert not list(transcriber.skip_reused(lib.iter_new(), lib))
+    assert not registered
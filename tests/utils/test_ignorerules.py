@@ -0,0 +1,35 @@
+import pytest
+
+from mmdiary.utils.ignorerules import IgnoreRules, is_ignored
+
+
+@pytest.mark.parametrize(
+    "patterns,path,is_dir,expected",
+    [
+        (["*.tmp"], "a.tmp", False, True),
+        (["*.tmp"], "dir/sub/a.tmp", False, True),
+        (["*.tmp"], "a.mp4", False, None),
+        (["# comment", ""], "a.mp4", False, None),
+        (["/old"], "old", True, True),
+        (["/old"], "sub/old", True, None),
+        (["old/"], "sub/old", True, True),
+        (["old/"], "sub/old", False, None),
+        (["archive/*/raw"], "archive/2020/raw", True, True),
+        (["archive/*/raw"], "archive/2020/x/raw", True, None),
+        (["archive/**/raw"], "archive/2020/x/raw", True, True),
+        (["**/raw"], "raw", True, True),
+        (["2020-0[1-3]*"], "2020-02-01.mp4", False, True),
+        (["2020-0[!1-3]*"], "2020-02-01.mp4", False, None),
+        (["*.mp4", "!keep.mp4"], "keep.mp4", False, False),
+    ],
+)
+def test_match(patterns, path, is_dir, expected):
+    assert IgnoreRules(patterns).match(path, is_dir) == expected
+
+
+def test_chain():
+    chain = (("", IgnoreRules(["*.mp4"])), ("sub", IgnoreRules(["!/keep.mp4"])))
+    assert is_ignored(chain, "a.mp4", False)
+    assert is_ignored(chain, "sub/a.mp4", False)
+    assert not is_ignored(chain, "sub/keep.mp4", False)
+    assert is_ignored(chain, "keep.mp4", False)
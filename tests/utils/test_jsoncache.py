@@ -0,0 +1,147 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from mmdiary.utils import jsoncache
+
+
+def make_cache(monkeypatch, filename, backend):
+    monkeypatch.setenv("MMDIARY_CACHE", str(filename))
+    monkeypatch.setenv("MMDIARY_CACHE_BACKEND", backend)
+    return jsoncache.JsonCache()
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_get_set(tmp_path, monkeypatch, backend):
+    cache = make_cache(monkeypatch, tmp_path / "cache", backend)
+    filename = str(tmp_path / "a.json")
+    cache.set({"text": "текст"}, filename)
+    assert cache.get(filename) == {"text": "текст"}
+
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"text": "new"}, f)
+    os.utime(filename, (1, 1))
+    assert cache.get(filename) == {"text": "new"}
+
+    os.unlink(filename)
+    with pytest.raises(FileNotFoundError):
+        cache.get(filename)
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_get_missing(tmp_path, monkeypatch, backend):
+    cache = make_cache(monkeypatch, tmp_path / "cache", backend)
+    with pytest.raises(FileNotFoundError):
+        cache.get(str(tmp_path / "a.json"))
+    cache.flush()
+    # nothing was changed, so nothing is saved and swept
+    assert not os.path.exists(str(tmp_path / "cache") + ".sweep")
+
+
+def test_sqlite_migration(tmp_path, monkeypatch):
+    filename = str(tmp_path / "a.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"text": "on disk"}, f)
+    mtime = os.stat(filename).st_mtime
+    with open(tmp_path / "cache", "wb") as f:
+        pickle.dump({filename: (mtime, {"text": "cached"})}, f)
+
+    cache = make_cache(monkeypatch, tmp_path / "cache", "sqlite")
+    assert cache.get(filename) == {"text": "cached"}
+    assert os.path.exists(str(tmp_path / "cache") + ".pickle.bak")
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_readonly(tmp_path, monkeypatch, backend):
+    cache = make_cache(monkeypatch, tmp_path / "cache", backend)
+    filename = str(tmp_path / "a.json")
+    cache.set({"videos": [{"text": "a"}], "state": "none"}, filename)
+
+    view = cache.get(filename, readonly=True)
+    assert view == {"videos": [{"text": "a"}], "state": "none"}
+    with pytest.raises(TypeError):
+        view["state"] = "uploaded"
+    with pytest.raises(TypeError):
+        view["videos"][0]["text"] = "b"
+
+    cont = jsoncache.thaw(view)
+    cont["videos"][0]["text"] = "b"
+    assert cache.get(filename, readonly=True)["videos"][0]["text"] == "a"
+    assert json.dumps(cont)
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_shared(tmp_path, backend):
+    filename = str(tmp_path / "cache")
+    storage1 = jsoncache.BACKENDS[backend](filename)
+    storage2 = jsoncache.BACKENDS[backend](filename)
+    storage1.get("a.json")
+    storage2.get("a.json")
+
+    storage1.set("a.json", 1.0, {"text": "a"}, 10)
+    storage2.set("b.json", 1.0, {"text": "b"}, 10)
+    storage2.set("a.json", 0.5, {"text": "old a"}, 10)
+    storage1.flush()
+    storage2.flush()
+
+    storage = jsoncache.BACKENDS[backend](filename)
+    assert storage.get("a.json") == (1.0, {"text": "a"})
+    assert storage.get("b.json") == (1.0, {"text": "b"})
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_prune(tmp_path, monkeypatch, backend):
+    cache = make_cache(monkeypatch, tmp_path / "cache", backend)
+    filenames = [str(tmp_path / f"{i}.json") for i in range(3)]
+    for filename in filenames:
+        cache.set({"text": filename}, filename)
+    cache.flush()
+    os.unlink(filenames[0])
+
+    offline = str(tmp_path / "offline" / "a.json")
+    storage = jsoncache.BACKENDS[backend](str(tmp_path / "cache"))
+    storage.set(offline, 1.0, {}, 10)
+    storage.flush()
+
+    # swept on the first save, the next sweep is after SWEEP_INTERVAL
+    storage = jsoncache.BACKENDS[backend](str(tmp_path / "cache"))
+    assert storage.get(filenames[0]) is not None
+
+    monkeypatch.setattr(jsoncache, "SWEEP_INTERVAL", 0)
+    storage.set(filenames[2], 2.0, {}, 10)
+    storage.flush()
+
+    storage = jsoncache.BACKENDS[backend](str(tmp_path / "cache"))
+    assert storage.get(filenames[0]) is None
+    assert storage.get(filenames[1]) is not None
+    assert storage.get(offline) is not None
+
+
+def test_limits():
+    limits = jsoncache.CacheLimits(max_size=25, max_age=100)
+    entries = [("a", 1000, 10), ("b", 990, 10), ("c", 980, 10), ("d", 800, 1)]
+    assert limits.evicted(entries, 1000) == {"c", "d"}
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_transaction(tmp_path, monkeypatch, backend):
+    cache = make_cache(monkeypatch, tmp_path / "cache", backend)
+    filename = str(tmp_path / "a.json")
+    cache.set({"state": "none"}, filename)
+
+    with cache.transaction() as saved:
+        assert cache.set({"state": "converted"}, filename) is None
+        assert cache.get(filename) == {"state": "converted"}
+        with open(filename, encoding="utf-8") as f:
+            assert json.load(f) == {"state": "none"}
+    assert [entry[0] for entry in saved] == [filename]
+    assert cache.get(filename) == {"state": "converted"}
+
+    with pytest.raises(RuntimeError):
+        with cache.transaction():
+            cache.set({"state": "uploaded"}, filename)
+            raise RuntimeError()
+    assert cache.get(filename) == {"state": "converted"}
+    assert not os.path.exists(filename + ".tmp")
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+from mmdiary.utils import jsoncache, manifest, medialib
+
+
+def test_mediafile(tmp_path, monkeypatch):
+    monkeypatch.setattr(medialib, "SIDECAR_MODE", "manifest")
+
+    def no_json_file(*args):
+        raise AssertionError(f"manifest entry is looked up in files cache: {args}")
+
+    monkeypatch.setattr(medialib.g_cache, "get", no_json_file)
+    (tmp_path / "2024-01-01_10-00-00.mp3").write_bytes(b"")
+    (tmp_path / "2024-01-02_10-00-00.mp3").write_bytes(b"")
+    mf = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"))
+    assert not mf.have_json()
+    mf.save_json({"recordtime": "2024-01-01 10:00:00", "text": "a"})
+    assert not os.path.exists(mf.json_name())
+    assert os.path.exists(tmp_path / manifest.MANIFEST_FILE)
+
+    mf = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"))
+    assert mf.have_json()
+    mf.update_fields({"state": "done"})
+    assert medialib.MediaFile(mf.name()).load_json() == {
+        "recordtime": "2024-01-01 10:00:00",
+        "text": "a",
+        "state": "done",
+    }
+
+    lib = medialib.MediaLib(str(tmp_path))
+    processed = lib.get_processed()
+    assert [str(mf) for mf in processed] == [mf.name()]
+    assert processed[0].recorddate() == "2024-01-01"
+    assert len(lib.get_new()) == 1
+
+    with medialib.transaction():
+        processed[0].update_fields({"state": "none"})
+    assert medialib.MediaFile(mf.name()).state() == "none"
+
+    processed[0].remove_json()
+    assert not medialib.MediaFile(mf.name()).have_json()
+
+
+def test_transaction_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(medialib, "SIDECAR_MODE", "manifest")
+    in_manifest = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"))
+    in_manifest.save_json({"state": "old"})
+    # separate json file has priority over the sidecar mode
+    (tmp_path / "2024-01-02_10-00-00.json").write_text('{"state": "old"}')
+    in_file = medialib.MediaFile(str(tmp_path / "2024-01-02_10-00-00.mp3"))
+
+    def fail(path):
+        raise OSError(f"sync failed: {path}")
+
+    monkeypatch.setattr(jsoncache, "fsync", fail)
+    with pytest.raises(OSError):
+        with medialib.transaction():
+            in_manifest.update_fields({"state": "new"})
+            in_file.update_fields({"state": "new"})
+    assert medialib.MediaFile(in_manifest.name()).load_json() == {"state": "old"}
+    assert medialib.MediaFile(in_file.name()).load_json() == {"state": "old"}
+
+
+def test_convert(tmp_path):
+    for name in ("a", "b"):
+        with open(tmp_path / f"{name}.json", "w", encoding="utf-8") as f:
+            json.dump({"name": name}, f)
+    assert manifest.convert(str(tmp_path), True) == 2
+    assert os.listdir(tmp_path) == [manifest.MANIFEST_FILE]
+    store = manifest.ManifestStore()
+    assert store.get(str(tmp_path / "b.json")) == {"name": "b"}
+    store.set({"name": "new"}, str(tmp_path / "b.json"))
+
+    assert manifest.convert(str(tmp_path), False) == 2
+    with open(tmp_path / "b.json", encoding="utf-8") as f:
+        assert json.load(f) == {"name": "new"}
+    assert not os.path.exists(tmp_path / manifest.MANIFEST_FILE)
+
+
+def test_convert_skipped(tmp_path):
+    for name in ("skip/a", "skip/sub/b", "excluded/c", "ignored/d", "e"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path / f"{name}.json", "w", encoding="utf-8") as f:
+            json.dump({"name": name}, f)
+    (tmp_path / "skip" / medialib.NO_SCAN_MARKER).write_bytes(b"")
+    (tmp_path / ".mmdiaryignore").write_text("ignored/\n", encoding="utf-8")
+    assert manifest.convert(f"{tmp_path},exclude=excluded/", True) == 1
+    assert os.path.exists(tmp_path / manifest.MANIFEST_FILE)
+    for name in ("skip/a", "skip/sub/b", "excluded/c", "ignored/d"):
+        assert os.path.exists(tmp_path / f"{name}.json")
@@ -0,0 +1,252 @@
+import os
+
+import pytest
+
+from mmdiary.utils import libwalk, medialib
+
+OLD_MTIME = 1000000000
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{}")
+
+
+def make_old(root):
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (OLD_MTIME, OLD_MTIME))
+
+
+def names(mfs):
+    return sorted(os.path.basename(str(mf)) for mf in mfs)
+
+
+def test_scan(tmp_path):
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.json")
+    touch(tmp_path / "b" / "c" / "2024-01-02_10-00-00.mp4")
+    touch(tmp_path / "b" / "notes.txt")
+    touch(tmp_path / "skip" / medialib.NO_SCAN_MARKER)
+    touch(tmp_path / "skip" / "2024-01-03_10-00-00.mp3")
+
+    lib = medialib.MediaLib(str(tmp_path))
+    assert names(lib.get_processed()) == ["2024-01-01_10-00-00.mp3"]
+    assert names(lib.get_new()) == ["2024-01-02_10-00-00.mp4"]
+
+
+def test_scan_index_reuse(tmp_path, monkeypatch):
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "b" / "2024-01-02_10-00-00.mp3")
+    make_old(tmp_path)
+
+    lib = medialib.MediaLib(str(tmp_path))
+    assert len(lib.get_new()) == 2
+
+    listed = []
+    scandir = os.scandir
+
+    def scandir_counter(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir_counter)
+    assert len(lib.get_new()) == 2
+    assert not listed
+
+    touch(tmp_path / "b" / "2024-01-02_11-00-00.mp3")
+    os.utime(tmp_path / "b", (OLD_MTIME + 1, OLD_MTIME + 1))
+    assert len(lib.get_new()) == 3
+    assert listed == [str(tmp_path / "b")]
+
+
+def test_scan_rules(tmp_path):
+    touch(tmp_path / "skip" / medialib.NO_SCAN_MARKER)
+    touch(tmp_path / "skip" / "sub" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "tmp" / "2024-01-02_10-00-00.mp3")
+    touch(tmp_path / "a" / "2024-01-03_10-00-00.mp3")
+    touch(tmp_path / "a" / "2024-01-03_11-00-00.mp3")
+    touch(tmp_path / "a" / "b" / "2024-01-04_10-00-00.mp3")
+    with open(tmp_path / "a" / ".mmdiaryignore", "w", encoding="utf-8") as f:
+        f.write("*11-00-00.mp3\n")
+
+    lib = medialib.MediaLib(str(tmp_path) + ",exclude=tmp/")
+    assert names(lib.get_new()) == ["2024-01-03_10-00-00.mp3", "2024-01-04_10-00-00.mp3"]
+
+    lib = medialib.MediaLib(str(tmp_path) + ",maxdepth=1")
+    assert names(lib.get_new()) == [
+        "2024-01-02_10-00-00.mp3",
+        "2024-01-03_10-00-00.mp3",
+    ]
+
+
+def test_scan_symlinks(tmp_path):
+    touch(tmp_path / "lib" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "ext" / "2024-01-02_10-00-00.mp3")
+    os.symlink(tmp_path / "ext", tmp_path / "lib" / "ext")
+    os.symlink(tmp_path / "lib", tmp_path / "ext" / "loop")
+
+    assert len(medialib.MediaLib(str(tmp_path / "lib")).get_new()) == 1
+    assert len(medialib.MediaLib(str(tmp_path / "lib") + ",symlinks=1").get_new()) == 2
+
+
+def test_scan_many_roots(tmp_path):
+    touch(tmp_path / "r1" / "a" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "r1" / "a" / "2024-01-01_10-00-00.json")
+    touch(tmp_path / "r2" / "2024-01-02_10-00-00.mp3")
+
+    lib = medialib.MediaLib([str(tmp_path / "r1"), str(tmp_path / "r2") + ",maxdepth=0"])
+    assert names(lib.get_all()) == ["2024-01-01_10-00-00.mp3", "2024-01-02_10-00-00.mp3"]
+    assert names(lib.get_new()) == ["2024-01-02_10-00-00.mp3"]
+
+
+def test_scan_stat_reuse(tmp_path, monkeypatch):
+    touch(tmp_path / "2024-01-01_10-00-00.mp3")
+    with open(tmp_path / "2024-01-01_10-00-00.json", "w", encoding="utf-8") as f:
+        f.write('{"recordtime": "2024-01-01 10:00:00"}')
+
+    lib = medialib.MediaLib(str(tmp_path))
+
+    def fail(*args):
+        raise AssertionError(f"unexpected call {args}")
+
+    monkeypatch.setattr(os.path, "exists", fail)
+    (mf,) = lib.get_processed()
+    monkeypatch.setattr(os, "stat", fail)
+    assert mf.recorddate() == "2024-01-01"
+
+
+def test_iter(tmp_path):
+    for d in ("c", "a", "b"):
+        touch(tmp_path / d / f"2024-01-0{ord(d) - ord('a') + 1}_10-00-00.mp3")
+        touch(tmp_path / d / f"2024-01-0{ord(d) - ord('a') + 1}_11-00-00.mp3")
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.json")
+    touch(tmp_path / "b" / "2024-01-05_10-00-00.json")
+
+    lib = medialib.MediaLib(str(tmp_path))
+    assert sorted(map(str, lib.iter_all())) == sorted(map(str, lib.get_all()))
+    assert list(map(str, lib.iter_all(window=100))) == sorted(map(str, lib.get_all()))
+    assert list(map(str, lib.iter_new(window=100))) == list(map(str, lib.get_new()))
+    assert list(map(str, lib.iter_processed(window=100))) == list(map(str, lib.get_processed()))
+    assert names(lib.iter_processed(should_have_file=False)) == [
+        "2024-01-01_10-00-00.mp3",
+        "2024-01-05_10-00-00.mp4",
+    ]
+
+
+def test_duplicates(tmp_path):
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.json")
+    touch(tmp_path / "b" / "2024-01-01_10-00-00.mp3")
+    touch(tmp_path / "b" / "2024-01-02_10-00-00.mp3")
+    touch(tmp_path / "c" / "2024-01-02_10-00-00.json")
+
+    lib = medialib.MediaLib(str(tmp_path))
+    expected = [
+        str(tmp_path / "a" / "2024-01-01_10-00-00.mp3"),
+        str(tmp_path / "b" / "2024-01-02_10-00-00.mp3"),
+        str(tmp_path / "c" / "2024-01-02_10-00-00.mp4"),
+    ]
+    assert sorted(map(str, lib.get_all())) == expected
+    assert list(map(str, lib.iter_all(window=100))) == expected
+    assert list(map(str, lib.get_new())) == expected[1:2]
+    assert list(map(str, lib.iter_new())) == expected[1:2]
+
+
+def test_metadata_only(tmp_path):
+    mf = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"), metadata_only=True)
+    mf.save_json({"recordtime": "2024-01-01 10:00:00", "text": "long text", "caption": "c"})
+
+    mf = medialib.MediaFile(str(tmp_path / "2024-01-01_10-00-00.mp3"), metadata_only=True)
+    assert mf.recordtime() == "2024-01-01 10:00:00"
+    assert "text" not in mf.metadata()
+    assert mf.have_field("text")
+    assert mf.get_field("text") == "long text"
+    assert mf.json()["caption"] == "c"
+
+    mf.update_fields({"state": "uploaded"})
+    assert mf.state() == "uploaded"
+    assert "text" not in mf.metadata()
+    assert mf.load_json()["text"] == "long text"
+
+
+def test_find(tmp_path, monkeypatch):
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.mp4")
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.json")
+    touch(tmp_path / "a" / "2024-01-02_10-00-00.mp4")
+    touch(tmp_path / "b" / "2024-01-02_11-00-00.mp4")
+    touch(tmp_path / "b" / "2024-01-02_11-00-00.json")
+    make_old(tmp_path)
+    lib = medialib.MediaLib(str(tmp_path / "a"))
+    lib.get_all()
+    lib = medialib.MediaLib(str(tmp_path / "b"))
+    lib.get_all()
+
+    monkeypatch.setattr(os, "scandir", None)
+    lib = medialib.MediaLib([str(tmp_path / "a"), str(tmp_path / "b")])
+    assert names(lib.find("01_10")) == ["2024-01-01_10-00-00.mp4"]
+    assert names(lib.find("2024-01")) == ["2024-01-01_10-00-00.mp4", "2024-01-02_11-00-00.mp4"]
+    assert names(lib.find("b" + os.sep + "20")) == ["2024-01-02_11-00-00.mp4"]
+    assert not lib.find("12-00")
+    assert names(medialib.MediaLib(str(tmp_path / "a")).find("mp4")) == ["2024-01-01_10-00-00.mp4"]
+    monkeypatch.undo()
+
+    # index is out of date: new matching file makes the match ambiguous
+    touch(tmp_path / "b" / "2024-01-01_10-30-00.mp4")
+    touch(tmp_path / "b" / "2024-01-01_10-30-00.json")
+    os.utime(tmp_path / "b", (OLD_MTIME + 60, OLD_MTIME + 60))
+    lib = medialib.MediaLib([str(tmp_path / "a"), str(tmp_path / "b")])
+    assert lib.find("01_10") is None
+    lib.get_all()
+    assert len(lib.find("01_10")) == 2
+
+    # indexed file was removed without the directory mtime change
+    os.unlink(tmp_path / "a" / "2024-01-01_10-00-00.mp4")
+    os.utime(tmp_path / "a", (OLD_MTIME, OLD_MTIME))
+    assert lib.find("01_10") is None
+
+
+def test_find_rules(tmp_path):
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.mp4")
+    touch(tmp_path / "a" / "2024-01-01_10-00-00.json")
+    touch(tmp_path / "a" / "2024-01-01_11-00-00.mp4")
+    touch(tmp_path / "a" / "2024-01-01_11-00-00.json")
+    touch(tmp_path / "tmp" / "2024-01-01_12-00-00.mp4")
+    touch(tmp_path / "tmp" / "2024-01-01_12-00-00.json")
+    with open(tmp_path / "a" / ".mmdiaryignore", "w", encoding="utf-8") as f:
+        f.write("*11-00-00.mp4\n")
+    make_old(tmp_path)
+    # the index is filled by the library without the exclude option
+    medialib.MediaLib(str(tmp_path)).get_all()
+
+    lib = medialib.MediaLib(str(tmp_path) + ",exclude=tmp/")
+    assert names(lib.get_processed()) == ["2024-01-01_10-00-00.mp4"]
+    assert names(lib.find("2024-01-01")) == ["2024-01-01_10-00-00.mp4"]
+    lib = medialib.MediaLib(str(tmp_path) + ",maxdepth=0")
+    assert not lib.find("2024-01-01")
+
+
+def test_prefetch(tmp_path):
+    for i in range(20):
+        touch(tmp_path / f"2024-01-{i + 1:02}_10-00-00.mp3")
+        with open(tmp_path / f"2024-01-{i + 1:02}_10-00-00.json", "w", encoding="utf-8") as f:
+            f.write(f'{{"recordtime": "2024-01-{i + 1:02} 10:00:00"}}')
+    touch(tmp_path / "2024-02-01_10-00-00.mp3")
+    files = medialib.MediaLib(str(tmp_path)).get_all()
+    files.sort()
+
+    res = list(medialib.prefetch(iter(files), threads=2))
+    assert res == files
+    assert [mf.recorddate() for mf in res[:20]] == [f"2024-01-{i + 1:02}" for i in range(20)]
+
+
+def test_parse_root():
+    assert libwalk.parse_root("/a/b") == ("/a/b", {})
+    assert libwalk.parse_root("/a,b/c,exclude=*.tmp,maxdepth=2") == (
+        "/a,b/c",
+        {"exclude": ["*.tmp"], "maxdepth": 2},
+    )
+    assert libwalk.parse_root("/a, b,c") == ("/a, b,c", {})
+    assert libwalk.parse_root("/a,symlinks=1,b") == ("/a,symlinks=1,b", {})
+    with pytest.raises(UserWarning):
+        libwalk.parse_root("/a,depth=1")
@@ -0,0 +1,73 @@
+import os
+
+from photo_importer import config as pi_config
+from photo_importer import fileprop
+
+from mmdiary.utils import propcache
+
+
+def test_propcache(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_CACHE", str(tmp_path / "cache"))
+    calls = []
+    orig_get = fileprop.FileProp.get
+
+    def get(self, fullname):
+        calls.append(fullname)
+        return orig_get(self, fullname)
+
+    monkeypatch.setattr(fileprop.FileProp, "get", get)
+    names = []
+    for i in range(5):
+        name = tmp_path / f"2024-01-0{i + 1}_10-00-00.txt"
+        name.write_bytes(b"")
+        names.append(str(name))
+    conf = pi_config.Config()
+    conf.set("main", "time_src_audio", "name")
+    conf.set("main", "file_ext_audio", "txt")
+
+    cache = propcache.PropCache(conf)
+    res = cache.get_many(names, threads=3)
+    assert [prop.time().day for prop in res] == [1, 2, 3, 4, 5]
+    assert sorted(calls) == names
+    cache.save()
+
+    calls.clear()
+    os.utime(names[0], ns=(0, 0))
+    cache = propcache.PropCache(conf)
+    res = cache.get_many(names)
+    assert calls == names[:1]
+    assert res[1].type() == fileprop.AUDIO
+    assert res[1].time().day == 2
+    assert res[1].ext() == ".txt"
+
+
+def test_merge(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMDIARY_CACHE", str(tmp_path / "cache"))
+    calls = []
+    orig_get = fileprop.FileProp.get
+
+    def get(self, fullname):
+        calls.append(fullname)
+        return orig_get(self, fullname)
+
+    monkeypatch.setattr(fileprop.FileProp, "get", get)
+    names = []
+    for i in range(2):
+        name = tmp_path / f"2024-01-0{i + 1}_10-00-00.txt"
+        name.write_bytes(b"")
+        names.append(str(name))
+    conf = pi_config.Config()
+    conf.set("main", "time_src_audio", "name")
+    conf.set("main", "file_ext_audio", "txt")
+
+    # two processes update the cache concurrently
+    first = propcache.PropCache(conf)
+    second = propcache.PropCache(conf)
+    first.get(names[0])
+    second.get(names[1])
+    first.save()
+    second.save()
+
+    calls.clear()
+    propcache.PropCache(conf).get_many(names)
+    assert not calls
@@ -0,0 +1,87 @@
+import os
+
+from mmdiary.utils import medialib, watcher
+
+
+def test_debouncer(tmp_path):
+    name = tmp_path / "a.mp3"
+    name.write_bytes(b"a")
+    deb = watcher.Debouncer(10)
+    deb.add(str(name), now=0)
+    assert deb.timeout(now=0) == 10
+    assert deb.ready(now=5) == []
+    # first check remembers size/mtime, second confirms it
+    assert deb.ready(now=10) == []
+    assert deb.ready(now=20) == [str(name)]
+    assert len(deb) == 0
+
+    deb.add(str(name), now=30)
+    assert deb.ready(now=40) == []
+    name.write_bytes(b"ab")
+    assert deb.ready(now=50) == []
+    assert deb.ready(now=60) == [str(name)]
+
+    deb.add(str(tmp_path / "missing.mp3"), now=0)
+    assert deb.ready(now=100) == []
+    assert len(deb) == 0
+
+
+def read_all(w):
+    res = set()
+    while True:
+        changed = w.read(0.2)
+        if not changed:
+            return res
+        res |= changed
+
+
+def test_inotify(tmp_path):
+    (tmp_path / "skip").mkdir()
+    (tmp_path / "skip" / medialib.NO_SCAN_MARKER).write_bytes(b"")
+    w = watcher.InotifyWatcher([str(tmp_path)])
+    (tmp_path / "a.mp3").write_bytes(b"a")
+    (tmp_path / "skip" / "b.mp3").write_bytes(b"b")
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / "c.mp3").write_bytes(b"c")
+    assert read_all(w) == {str(tmp_path / "a.mp3"), str(sub / "c.mp3")}
+    (sub / "d.mp3").write_bytes(b"d")
+    assert read_all(w) == {str(sub / "d.mp3")}
+    w.close()
+
+
+def test_polling(tmp_path):
+    (tmp_path / "a.mp3").write_bytes(b"a")
+    w = watcher.PollingWatcher([str(tmp_path)], interval=0)
+    assert w.read(0) == set()
+    (tmp_path / "b.mp3").write_bytes(b"b")
+    os.utime(tmp_path / "a.mp3", ns=(0, 0))
+    assert w.read(0) == {str(tmp_path / "a.mp3"), str(tmp_path / "b.mp3")}
+
+
+def make_tree(root):
+    for name in ("a.mp3", "tmp/b.mp3", "sub/c.mp3", "sub/deep/d.mp3", "sub/e.tmp.mp3"):
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(b"x")
+    (root / "sub" / ".mmdiaryignore").write_text("*.tmp.mp3\n")
+
+
+def test_walk_files_options(tmp_path):
+    make_tree(tmp_path)
+    files = watcher.walk_files(f"{tmp_path},exclude=tmp/,maxdepth=1")
+    files = sorted(os.path.relpath(f, tmp_path) for f in files if medialib.is_media_file(f))
+    assert files == ["a.mp3", "sub/c.mp3"]
+
+
+def test_inotify_options(tmp_path):
+    make_tree(tmp_path)
+    w = watcher.InotifyWatcher([f"{tmp_path},exclude=tmp/,maxdepth=1"])
+    for name in ("tmp/f.mp3", "sub/g.mp3", "sub/h.tmp.mp3", "sub/deep/i.mp3"):
+        (tmp_path / name).write_bytes(b"y")
+    new = tmp_path / "new"
+    new.mkdir()
+    (new / "j.mp3").write_bytes(b"j")
+    (new / "deeper").mkdir()
+    (new / "deeper" / "k.mp3").write_bytes(b"k")
+    assert read_all(w) == {str(tmp_path / "sub" / "g.mp3"), str(new / "j.mp3")}
+    w.close()